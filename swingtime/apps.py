@@ -15,6 +15,7 @@ class SwingtimeConfig(AppConfig):
         Any app specific startup code, e.g., register signals,
         should go here.
         """
+        from . import signals  # noqa: connects the signal handlers
 
 
 #########################################################################
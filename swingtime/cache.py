@@ -0,0 +1,166 @@
+'''
+Shared caching helpers for swingtime.
+
+'''
+#######################
+from __future__ import print_function, unicode_literals
+
+import time
+from collections import namedtuple
+
+from django.core.cache import caches
+
+from .conf import settings as swingtime_settings
+
+#######################
+
+KEY_PREFIX = 'swingtime'
+
+# how long (in seconds) a process waits for another one to finish computing a
+# missing value before computing it itself, the polling interval while
+# waiting, and how long the lock of the computing process is held at most.
+LOCK_WAIT = 0.5
+LOCK_POLL_INTERVAL = 0.05
+LOCK_TIMEOUT = 10
+
+# how long (in seconds) an expired value is kept, to be served while one
+# process computes its replacement.
+STALE_TIMEOUT = 15 * 60
+
+# a value cached by ``get_or_compute``, with the time it expires.
+_Entry = namedtuple('_Entry', 'expires value')
+
+#-------------------------------------------------------------------------------
+
+
+def get_cache():
+    '''
+    Return the Django cache used by swingtime
+    (see swingtime_settings.CACHE_ALIAS).
+
+    '''
+    return caches[swingtime_settings.CACHE_ALIAS]
+
+
+#-------------------------------------------------------------------------------
+
+
+def make_key(*parts):
+    '''
+    Build a swingtime cache key from the given parts.
+
+    '''
+    return ':'.join(
+        ['{}'.format(p) for p in (KEY_PREFIX, ) + parts])
+
+
+#-------------------------------------------------------------------------------
+
+
+def get_or_compute(key, compute, timeout):
+    '''
+    Return the cached value for ``key``, calling ``compute()`` to produce
+    (and cache) it when missing or expired.
+
+    A short-lived lock key makes sure that, across all the processes sharing
+    the cache, only one of them computes the value. While it does, the
+    others get the expired value, which is kept for ``STALE_TIMEOUT`` more
+    seconds; if there is none, they wait up to ``LOCK_WAIT`` seconds for the
+    value to show up before computing it themselves.
+
+    If ``timeout`` is 0, caching is disabled and ``compute()`` is always
+    called.
+    '''
+    if timeout == 0:
+        return compute()
+
+    cache = get_cache()
+    lock_key = key + ':lock'
+    entry = cache.get(key)
+    if isinstance(entry, _Entry):
+        expires, value = entry
+        if expires is None or time.time() < expires:
+            return value
+        if not cache.add(lock_key, True, LOCK_TIMEOUT):
+            return value
+    elif not cache.add(lock_key, True, LOCK_TIMEOUT):
+        waited = 0.0
+        while waited < LOCK_WAIT:
+            time.sleep(LOCK_POLL_INTERVAL)
+            waited += LOCK_POLL_INTERVAL
+            entry = cache.get(key)
+            if isinstance(entry, _Entry):
+                return entry.value
+        lock_key = None
+
+    try:
+        value = compute()
+        if timeout is None:
+            cache.set(key, _Entry(None, value), None)
+        else:
+            cache.set(key, _Entry(time.time() + timeout, value),
+                      timeout + STALE_TIMEOUT)
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+    return value
+
+
+#-------------------------------------------------------------------------------
+
+
+def _version_key(location_id):
+    return make_key('location-version', location_id)
+
+
+#-------------------------------------------------------------------------------
+
+
+def location_version(location_id):
+    '''
+    Return the current version of the bookings at the location with the given
+    primary key (see ``bump_location_version``).
+
+    A missing version is started from the current time in milliseconds,
+    rather than from 1, so that the keys of a version lost by the cache are
+    not reused.
+    '''
+    cache = get_cache()
+    key = _version_key(location_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+#-------------------------------------------------------------------------------
+
+
+def bump_location_version(location_id):
+    '''
+    Start a new version of the bookings at the location with the given
+    primary key, making all the keys built by ``location_key`` for the
+    previous one obsolete.
+
+    '''
+    cache = get_cache()
+    try:
+        cache.incr(_version_key(location_id))
+    except ValueError:
+        # no current version; the next one is started on demand.
+        pass
+
+
+#-------------------------------------------------------------------------------
+
+
+def location_key(location_id, *parts):
+    '''
+    Build a swingtime cache key from the given parts, scoped to the current
+    version of the bookings at the location with the given primary key.
+
+    '''
+    return make_key(*(parts +
+                      (location_id, 'v{}'.format(
+                          location_version(location_id)))))
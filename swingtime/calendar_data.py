@@ -0,0 +1,233 @@
+'''
+The month calendar data shared by the month view, the printable month views
+and the ``print_month`` command.
+
+The per-day buckets of a (location, year, month) are kept in the swingtime
+cache, under a key scoped to the version of the location's bookings (see
+``BookingLocation.version``) and to the content of its scheduled events,
+so the cached buckets never need to be invalidated.
+
+'''
+#######################
+from __future__ import print_function, unicode_literals
+
+import calendar
+from datetime import timedelta
+
+from django.db.models.functions import TruncMonth
+from django.utils.timezone import localtime
+from django.utils.timezone import now as datetime_now
+
+from . import cache, libvevent, utils
+from .conf import settings as swingtime_settings
+from .models import BookingLocation, Occurrence
+
+#######################
+
+#-------------------------------------------------------------------------------
+
+
+def version_key(location, *parts):
+    '''
+    Build a cache key from the given parts for data derived from the bookings
+    and scheduled events of ``location``: it is scoped to the version of its
+    bookings and to the digest of its scheduled events, since those are
+    refreshed periodically without a new version.
+
+    '''
+    digest = location.calendar_events_state()[0]
+    return location.cache_key(*(parts + (digest, )))
+
+
+#-------------------------------------------------------------------------------
+
+
+def compute_month_days(location, year, month, queryset=None):
+    '''
+    Return a dictionary mapping the days of the given month to the list of the
+    occurrences (stored and virtual) and scheduled events of ``location``
+    starting on that day, in start order; those which started in the previous
+    month are listed on the 1st.
+
+    The occurrences are ``libvevent.EventRecord`` display rows (see
+    ``OccurrenceManager.display_occurrences``), unless a base ``Occurrence``
+    ``queryset`` is given.
+
+    '''
+    dtstart, dtend = utils.month_range(year, month)
+    if queryset is None:
+        occurrences = Occurrence.objects.display_occurrences(
+            location, dtstart, dtend)
+    else:
+        occurrences = utils.merge_by_start(
+            queryset.overlapping(location, dtstart, dtend).order_by(
+                'start_time', 'end_time').iterator(),
+            Occurrence.objects.virtual_occurrences(location, dtstart, dtend))
+    all_occurrences = utils.merge_by_start(
+        occurrences,
+        libvevent.filter_list_by_month(location.scheduled_records, dtstart))
+    return utils.group_by_day(all_occurrences, dtstart)
+
+
+#-------------------------------------------------------------------------------
+
+
+def month_days(location, year, month):
+    '''
+    Return ``compute_month_days(location, year, month)``, from the swingtime
+    cache when possible.
+
+    '''
+    return cache.get_or_compute(
+        version_key(location, 'month-days', year, month),
+        lambda: compute_month_days(location, year, month),
+        swingtime_settings.MONTH_DATA_CACHE_TIMEOUT)
+
+
+#-------------------------------------------------------------------------------
+
+
+def month_navigation(location, year, month):
+    '''
+    Return the template context data for a month of ``location``, except for
+    the calendar itself (see ``month_data``).
+
+    '''
+    year, month = int(year), int(month)
+    dtstart, dtend = utils.month_range(year, month)
+    last_day = calendar.monthrange(year, month)[1]
+
+    return dict(
+        today=datetime_now(),
+        this_month=dtstart,
+        next_month=dtstart + timedelta(days=+last_day),
+        last_month=dtstart + timedelta(days=-1),
+        base_main_page_has_no_rightbar=
+        True,  # -- supress rightbar in month view.
+        location=location,
+    )
+
+
+#-------------------------------------------------------------------------------
+
+
+def month_data(location, year, month, queryset=None):
+    '''
+    Return the template context data for a month calendar of ``location``:
+
+    today
+        the current datetime.datetime value
+
+    calendar
+        a list of rows containing (day, items) cells, where day is the day of
+        the month integer and items is a (potentially empty) list of occurrence
+        for the day
+
+    this_month
+        a datetime.datetime representing the first day of the month
+
+    next_month
+        this_month + 1 month
+
+    last_month
+        this_month - 1 month
+
+    location
+        the ``BookingLocation``
+
+    The day buckets are cached (see ``month_days``), unless a custom
+    ``queryset`` is given.
+
+    '''
+    year, month = int(year), int(month)
+    if queryset is None:
+        by_day = month_days(location, year, month)
+    else:
+        by_day = compute_month_days(location, year, month, queryset)
+
+    data = month_navigation(location, year, month)
+    data['calendar'] = [[(d, by_day.get(d, [])) for d in row]
+                        for row in calendar.monthcalendar(year, month)]
+    return data
+
+
+#-------------------------------------------------------------------------------
+
+
+def load_month_data(room_slug, year, month):
+    '''
+    Return the ``month_data`` of the booking location with the given slug.
+
+    '''
+    location = BookingLocation.objects.resolve_slug(room_slug)
+    return month_data(location, year, month)
+
+
+#-------------------------------------------------------------------------------
+
+
+def year_summary(location, year):
+    '''
+    Return a summary of each of the 12 months of ``year`` for ``location``,
+    as a list of dictionaries (see ``OccurrenceQuerySet.month_summary``)
+    counting the stored and virtual occurrences starting in the month, with
+    the number of ``scheduled`` events starting in it.
+
+    The stored occurrences are aggregated in the database.
+
+    '''
+    year = int(year)
+    dtstart, dtend = utils.month_range(year, 1)[0], utils.month_range(
+        year, 12)[1]
+    months = [
+        dict(
+            month=utils.month_range(year, month)[0],
+            count=0,
+            events=0,
+            first_start=None,
+            first_title=None,
+            last_start=None,
+            last_title=None,
+            scheduled=0) for month in range(1, 13)
+    ]
+
+    def summary(dt):
+        return months[localtime(dt).month - 1]
+
+    for row in Occurrence.objects.month_summary(location, dtstart, dtend):
+        month = summary(row['month'])
+        row['month'] = month['month']
+        month.update(row)
+
+    # the virtual occurrences, and the events that have only virtual ones in
+    # a month
+    virtual_events = set()
+    for o in Occurrence.objects.virtual_occurrences(location, dtstart, dtend):
+        if o.start_time < dtstart:
+            continue
+        month = summary(o.start_time)
+        month['count'] += 1
+        if month['first_start'] is None or o.start_time < month['first_start']:
+            month['first_start'], month['first_title'] = o.start_time, o.title
+        if month['last_start'] is None or o.start_time >= month['last_start']:
+            month['last_start'], month['last_title'] = o.start_time, o.title
+        virtual_events.add((localtime(o.start_time).month, o.event_id))
+    if virtual_events:
+        stored = set(
+            (localtime(month).month, event_id)
+            for month, event_id in Occurrence.objects.filter(
+                location=location,
+                start_time__gte=dtstart,
+                start_time__lt=dtend,
+                cancelled=False,
+                event__in=set(e for m, e in virtual_events)).annotate(
+                    month=TruncMonth('start_time')).values_list(
+                        'month', 'event').order_by().distinct())
+        for month, event_id in virtual_events - stored:
+            months[month - 1]['events'] += 1
+
+    for record in location.scheduled_records.overlapping(dtstart, dtend):
+        if dtstart <= record.start_time < dtend:
+            summary(record.start_time)['scheduled'] += 1
+
+    return months
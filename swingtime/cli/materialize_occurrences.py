@@ -0,0 +1,18 @@
+"""
+Roll the materialization horizon of stored recurring events forward.
+"""
+#######################
+from __future__ import print_function, unicode_literals
+
+from swingtime.models import materialize_recurrences
+
+#######################
+DJANGO_COMMAND = 'main'
+HELP_TEXT = __doc__.strip()
+
+#############################################################
+
+
+def main(args):
+    count = materialize_recurrences()
+    print('Created {} occurrence(s).'.format(count))
@@ -31,5 +31,51 @@ TIMESLOT_MIN_COLUMNS = 1
 # a datetime.timedelta object
 DEFAULT_OCCURRENCE_DURATION = datetime.timedelta(hours=+1)
 
+# The maximum number of ``Occurrence`` rows written per INSERT statement when
+# creating recurring occurrences (see Event.add_occurrences).
+OCCURRENCE_BATCH_SIZE = 500
+
+# If not None, a datetime.timedelta value (e.g. datetime.timedelta(weeks=8)).
+# Recurring events then store their rule on the Event and only write out the
+# occurrences starting within this horizon from now; later occurrences are
+# expanded when read. Run ``manage.py swingtime materialize_occurrences``
+# periodically to roll the horizon forward.
+RECURRENCE_HORIZON = None
+
+# The alias (in settings.CACHES) of the Django cache used by swingtime.
+CACHE_ALIAS = 'default'
+
+# The number of seconds the external schedule for a location (see
+# BookingLocation.scheduled_events) is cached. Use 0 to disable caching, or
+# None to cache until explicitly invalidated.
+SCHEDULED_EVENTS_CACHE_TIMEOUT = 15 * 60
+
+# How long (in seconds) the booking locations resolved by slug are kept in
+# the shared cache; they are discarded whenever a booking location or a room
+# is saved or deleted. Use 0 to always look them up in the database.
+LOCATION_CACHE_TIMEOUT = 60 * 60
+
+# How long (in seconds) the per-day data of month calendars is cached; the
+# cache keys change with the bookings and with the content of the scheduled
+# events, which is checked again every SCHEDULED_EVENTS_CACHE_TIMEOUT, so this
+# only bounds the cache size. Use 0 to disable caching.
+MONTH_DATA_CACHE_TIMEOUT = 60 * 60
+
+# How long (in seconds) the rendered month and day calendar grids are cached;
+# their keys change as for the month data, so this only bounds the cache size.
+# Use 0 to disable caching.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# If not None, a 2-tuple of datetime.timedelta values (past, future) limiting
+# the occurrences in webcal feeds to those overlapping today - past up to
+# today + future, e.g.,
+# (datetime.timedelta(days=90), datetime.timedelta(days=365)).
+# Feeds may override this with the start/end or past_days/future_days query
+# parameters.
+WEBCAL_DEFAULT_WINDOW = None
+
 # If not None, passed to the calendar module's setfirstweekday function.
 CALENDAR_FIRST_WEEKDAY = 6
+
+# The number of events on each page of the event listing of a location.
+EVENT_LIST_PAGE_SIZE = 50
@@ -13,7 +13,7 @@ from django.forms.utils import from_current_timezone, to_current_timezone
 from django.forms.widgets import SelectDateWidget
 from django.utils.translation import ugettext_lazy as _
 
-from . import utils
+from . import timeslots, utils
 from .conf import settings as swingtime_settings
 from .models import *
 
@@ -93,18 +93,10 @@ def timeslot_options(interval=swingtime_settings.TIMESLOT_INTERVAL,
 
     Note that this is for form entry -- ignore timezone issues.
     '''
-    #     dt = utils.force_aware(datetime.combine(date.today(), time(0)))
-    #     dtstart = datetime.combine(dt.date(), start_time)
-    dt = datetime.combine(date.today(), time(0))
-    dtstart = datetime.combine(dt, start_time)
-    dtend = dtstart + end_delta
-    options = []
-
-    while dtstart <= dtend:
-        options.append((str(dtstart.time()), dtstart.strftime(fmt)))
-        dtstart += interval
-
-    return options
+    template = timeslots.get_template(
+        start_time=start_time, end_delta=end_delta, interval=interval, fmt=fmt)
+    return [(str(dt.time()), label)
+            for dt, label in zip(template.rowkeys, template.labels)]
 
 
 #-------------------------------------------------------------------------------
@@ -121,25 +113,37 @@ def timeslot_offset_options(
 
     Note that this is for form entry -- ignore timezone issues.
     '''
-    #     dt = utils.force_aware(date.today())
-    #     dtstart = utils.force_aware(datetime.combine(dt.date(), start_time), dt.tzinfo)
-    dt = datetime.combine(date.today(), time(0))
-    dtstart = datetime.combine(dt, start_time)
-    dtend = dtstart + end_delta
-    options = []
+    template = timeslots.get_template(
+        start_time=start_time, end_delta=end_delta, interval=interval, fmt=fmt)
+    return list(zip(template.offsets, template.labels))
+
+
+#===============================================================================
+class TimeslotSelect(forms.Select):
+    '''
+    A Select widget for time slots, whose choices are computed when rendered
+    (see ``timeslot_options`` and ``timeslot_offset_options``), so they do not
+    go stale in long running processes.
 
-    delta = utils.time_delta_total_seconds(dtstart - dt)
-    seconds = utils.time_delta_total_seconds(interval)
-    while dtstart <= dtend:
-        options.append((delta, dtstart.strftime(fmt)))
-        dtstart += interval
-        delta += seconds
+    '''
 
-    return options
+    #---------------------------------------------------------------------------
+    def __init__(self, attrs=None, offsets=False):
+        self.offsets = offsets
+        super(TimeslotSelect, self).__init__(attrs)
 
+    #---------------------------------------------------------------------------
+    @property
+    def choices(self):
+        if self.offsets:
+            return timeslot_offset_options()
+        return timeslot_options()
 
-default_timeslot_options = timeslot_options()
-default_timeslot_offset_options = timeslot_offset_options()
+    #---------------------------------------------------------------------------
+    @choices.setter
+    def choices(self, value):
+        # the choices are always the current time slot options
+        pass
 
 
 #===============================================================================
@@ -176,7 +180,7 @@ class SplitDateTimeWidget(forms.SplitDateTimeWidget):
     #---------------------------------------------------------------------------
     def __init__(self, attrs=None):
         widgets = (SelectDateWidget(attrs=attrs),
-                   forms.Select(choices=default_timeslot_options, attrs=attrs))
+                   TimeslotSelect(attrs=attrs))
         #super(SplitDateTimeWidget, self).__init__(widgets, attrs)
         forms.MultiWidget.__init__(self, widgets, attrs)
 
@@ -188,11 +192,11 @@ class MultipleOccurrenceForm(forms.Form):
 
     start_time_delta = forms.IntegerField(
         label=_(u'Start time'),
-        widget=forms.Select(choices=default_timeslot_offset_options))
+        widget=TimeslotSelect(offsets=True))
 
     end_time_delta = forms.IntegerField(
         label=_(u'End time'),
-        widget=forms.Select(choices=default_timeslot_offset_options))
+        widget=TimeslotSelect(offsets=True))
 
     # recurrence options
     repeats = forms.ChoiceField(
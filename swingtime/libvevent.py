@@ -6,15 +6,22 @@ All vevent objects are assumed to have the following attributes (at a minimum):
     * SUMMARY
     * LOCATION
 
+For display, vevents are reduced to compact ``EventRecord`` tuples (see
+``records_from_vevents``); the functions here accept either.
+
 """
 #######################
 from __future__ import print_function, unicode_literals
 
+import bisect
 import datetime
+import hashlib
 import itertools
+from collections import namedtuple
 
 import vobject
-from django.utils.timezone import is_naive, make_aware
+from django.utils.encoding import force_bytes, python_2_unicode_compatible
+from django.utils.timezone import is_aware, is_naive, make_aware, utc
 from django.utils.timezone import now as datetime_now
 
 #######################
@@ -22,12 +29,109 @@ from django.utils.timezone import now as datetime_now
 ###############################################################
 
 
+@python_2_unicode_compatible
+class EventRecord(
+        namedtuple('EventRecord', 'start_time end_time title location url')):
+    """
+    A compact, immutable record of an event, for display purposes.
+
+    It provides enough of the ``Occurrence`` interface (``event``, ``notes``
+    and ``get_absolute_url``) to be used in its place in the templates and
+    the timeslot table. ``url`` is ``None`` for events with no page.
+    """
+    __slots__ = ()
+
+    @property
+    def event(self):
+        return self
+
+    @property
+    def notes(self):
+        return ()
+
+    def get_absolute_url(self):
+        return self.url
+
+    def __str__(self):
+        return self.title
+
+
+###############################################################
+
+
+def record_from_vevent(vevent):
+    """
+    Return an EventRecord with the display fields of the given vevent.
+    """
+    location = getattr(vevent, 'location', None)
+    url = getattr(vevent, 'url', None)
+    return EventRecord(
+        vevent.dtstart.value,
+        vevent.dtend.value,
+        vevent.summary.value,
+        location.value if location is not None else '',
+        url.value if url is not None else None,
+    )
+
+
+###############################################################
+
+
+def records_from_vevents(vevent_seq):
+    """
+    Return the list of EventRecords for the given vevents,
+    e.g., the output of ``webcal.utils.make_vevent_list``.
+    """
+    return [record_from_vevent(vevent) for vevent in vevent_seq]
+
+
+###############################################################
+
+
+def _content_lines(component):
+    for child in component.getChildren():
+        if isinstance(child, vobject.base.Component):
+            for line in _content_lines(child):
+                yield line
+        elif child.name.upper() != 'DTSTAMP':
+            yield '{}{}:{!r}'.format(child.name.upper(),
+                                     sorted(child.params.items()), child.value)
+
+
+def content_digest(vevent_seq):
+    """
+    Return a hex digest of the content of the given vevents, ignoring their
+    DTSTAMP (which may be set to the time the list was built): it only
+    changes when the vevents themselves do.
+    """
+    digest = hashlib.md5()
+    for vevent in vevent_seq:
+        for line in _content_lines(vevent):
+            digest.update(force_bytes(line) + b'\n')
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+###############################################################
+
+
+def event_times(item):
+    """
+    Returns the (start, end) datetimes of a vevent or an EventRecord.
+    """
+    if isinstance(item, EventRecord):
+        return item.start_time, item.end_time
+    return item.dtstart.value, item.dtend.value
+
+
+###############################################################
+
+
 def has_overlap(vevent, start, end):
     """
     Returns True if the given vevent has some overlap with the given start and end datetimes.
     """
-    event_start = vevent.dtstart.value
-    event_end = vevent.dtend.value
+    event_start, event_end = event_times(vevent)
 
     assert not is_naive(start), 'start dt is naive'
     assert not is_naive(end), 'end dt is naive'
@@ -46,16 +150,90 @@ def has_overlap(vevent, start, end):
 ###############################################################
 
 
+class VEventIndex(object):
+    """
+    A sorted interval index over a vevent (or EventRecord) list, built once
+    and then used for any number of overlap queries.
+
+    Start and end times are held in arrays sorted by start time. A query
+    bisects to the vevents starting between (start - longest duration) and
+    end, and only checks the end times of those, so it runs in logarithmic
+    time (plus the size of the answer) instead of scanning every vevent.
+
+    The index is also a read-only sequence of the vevents, in start order.
+    """
+
+    def __init__(self, vevent_seq):
+        items = []
+        for vevent in vevent_seq:
+            event_start, event_end = event_times(vevent)
+            assert not is_naive(event_start), 'event_start dt is naive'
+            assert not is_naive(event_end), 'event_end dt is naive'
+            items.append((event_start, event_end, vevent))
+        items.sort(key=lambda item: item[0])
+
+        self.starts = [item[0] for item in items]
+        self.ends = [item[1] for item in items]
+        self.vevents = [item[2] for item in items]
+        self.max_duration = max(
+            [end - start for start, end, vevent in items] +
+            [datetime.timedelta(0)])
+
+    def __len__(self):
+        return len(self.vevents)
+
+    def __iter__(self):
+        return iter(self.vevents)
+
+    def __getitem__(self, index):
+        return self.vevents[index]
+
+    def overlapping(self, start, end):
+        """
+        Returns the list of vevents, in start order, which have some overlap
+        with the given start and end datetimes (see ``has_overlap``).
+        Either may be ``None``, for no bound.
+        """
+        lo, hi = 0, len(self.starts)
+        if start is not None:
+            assert not is_naive(start), 'start dt is naive'
+            lo = bisect.bisect_left(self.starts, start - self.max_duration)
+        if end is not None:
+            assert not is_naive(end), 'end dt is naive'
+            hi = bisect.bisect_right(self.starts, end)
+        return [
+            self.vevents[i] for i in range(lo, hi)
+            if start is None or self.ends[i] >= start
+        ]
+
+
+###############################################################
+
+
+def _filter_list(vevent_seq, start, end):
+    """
+    The vevents in ``vevent_seq`` (a sequence or a VEventIndex) which overlap
+    the given start and end datetimes.
+    """
+    if isinstance(vevent_seq, VEventIndex):
+        return iter(vevent_seq.overlapping(start, end))
+    return (vevent for vevent in vevent_seq if has_overlap(vevent, start, end))
+
+
+###############################################################
+
+
 def filter_list_by_day(vevent_seq, dt=None):
     """
     if dt is None, default to today.
+    vevent_seq may be a sequence of vevents or a VEventIndex.
     """
     dt = dt or datetime_now()
     if is_naive(dt):
         dt = make_aware(dt)
     start = datetime.datetime(dt.year, dt.month, dt.day, tzinfo=dt.tzinfo)
     end = start.replace(hour=23, minute=59, second=59)
-    return (vevent for vevent in vevent_seq if has_overlap(vevent, start, end))
+    return _filter_list(vevent_seq, start, end)
 
 
 ###############################################################
@@ -64,6 +242,7 @@ def filter_list_by_day(vevent_seq, dt=None):
 def filter_list_by_month(vevent_seq, dt=None):
     """
     if dt is None, default to this month.
+    vevent_seq may be a sequence of vevents or a VEventIndex.
     """
     dt = dt or datetime_now()
     if is_naive(dt):
@@ -82,7 +261,7 @@ def filter_list_by_month(vevent_seq, dt=None):
     assert not is_naive(start), "start {!r} is naive".format(start)
     assert not is_naive(end), "end {!r} is naive".format(end)
 
-    return (vevent for vevent in vevent_seq if has_overlap(vevent, start, end))
+    return _filter_list(vevent_seq, start, end)
 
 
 ###############################################################
@@ -91,56 +270,34 @@ def filter_list_by_month(vevent_seq, dt=None):
 def from_occurrence(o):
     """
     Return a vevent from an occurrence object.
+
+    Times are written in UTC (as stored occurrences come back from the
+    database), so the vevent never needs a VTIMEZONE of its own.
     """
+    start_time, end_time = o.start_time, o.end_time
+    if is_aware(start_time):
+        start_time = start_time.astimezone(utc)
+        end_time = end_time.astimezone(utc)
+
     cal = vobject.iCalendar()
     ev = cal.add('vevent')
-    ev.add('dtstamp').value = o.start_time
-    ev.add('dtstart').value = o.start_time
-    ev.add('dtend').value = o.end_time
+    ev.add('dtstamp').value = start_time
+    ev.add('dtstart').value = start_time
+    ev.add('dtend').value = end_time
     ev.add('summary').value = o.event.title
-    ev.add('location').value = "{}".format(o.event.location)
+    ev.add('location').value = "{}".format(o.location)
 
     desc = ''
     if o.event.description:
         desc += o.event.description
     for n in o.event.notes.all():
-        desc += '\n' + n
-    for n in o.notes.all():
-        desc += '\n' + n
+        desc += '\n' + n.note
+    if o.pk is not None:
+        # virtual occurrences (of a stored recurrence) have no notes.
+        for n in o.notes.all():
+            desc += '\n' + n.note
     desc = desc.strip()
     if desc:
         ev.add('description').value = desc
 
     return ev
-
-
-###############################################################
-
-
-class EventWrapper:
-    def __init__(self, vevent):
-        self.title = vevent.summary.value
-        self.location = vevent.summary.value
-
-
-###############################################################
-
-
-class OccurenceWrapper:
-    """
-    For display purposes, return a dictionary faking an occurence object.
-    """
-
-    def __init__(self, vevent):
-        self.start_time = vevent.dtstart.value
-        self.end_time = vevent.dtend.value
-        print(self.start_time, '--', self.end_time)
-
-        self.event = EventWrapper(vevent)
-        self.title = self.event.title
-        self.location = self.event.location
-        self.notes = []
-        self.get_absolute_url = None
-
-
-###############################################################
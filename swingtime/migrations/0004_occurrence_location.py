@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_occurrence_location(apps, schema_editor):
+    """
+    Copy ``event.location`` onto every existing occurrence, in primary key
+    batches so that large tables are not rewritten by a single statement;
+    each batch is committed on its own (the migration is not atomic), so
+    that its row locks are released before the next one.
+    """
+    Event = apps.get_model('swingtime', 'Event')
+    Occurrence = apps.get_model('swingtime', 'Occurrence')
+    db_alias = schema_editor.connection.alias
+
+    event_location = Event.objects.using(db_alias).filter(
+        pk=models.OuterRef('event_id')).values('location_id')[:1]
+    pks = Occurrence.objects.using(db_alias).order_by('pk').values_list(
+        'pk', flat=True)
+
+    last_pk = 0
+    while True:
+        batch = list(pks.filter(pk__gt=last_pk)[:BACKFILL_BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic(using=db_alias):
+            Occurrence.objects.using(db_alias).filter(
+                pk__gte=batch[0], pk__lte=batch[-1]).update(
+                    location_id=models.Subquery(event_location))
+        last_pk = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('swingtime', '0003_auto_20170602_1056'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occurrence',
+            name='location',
+            field=models.ForeignKey(
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to='swingtime.BookingLocation',
+                verbose_name='location'),
+        ),
+        migrations.RunPython(backfill_occurrence_location,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swingtime', '0004_occurrence_location'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='occurrence',
+            name='location',
+            field=models.ForeignKey(
+                editable=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to='swingtime.BookingLocation',
+                verbose_name='location'),
+        ),
+        migrations.AddIndex(
+            model_name='occurrence',
+            index=models.Index(
+                fields=['location', 'start_time'],
+                name='swingtime_occ_loc_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='occurrence',
+            index=models.Index(
+                fields=['location', 'end_time'],
+                name='swingtime_occ_loc_end_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swingtime', '0005_occurrence_location_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='duration',
+            field=models.DurationField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name='occurrence duration'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='materialized_until',
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name='materialized until'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='recurrence',
+            field=models.TextField(
+                blank=True, editable=False, verbose_name='recurrence rule'),
+        ),
+        migrations.AddField(
+            model_name='occurrence',
+            name='original_start_time',
+            field=models.DateTimeField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name='original start time'),
+        ),
+    ]
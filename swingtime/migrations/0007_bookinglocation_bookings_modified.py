@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swingtime', '0006_event_recurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookinglocation',
+            name='bookings_modified',
+            field=models.DateTimeField(
+                default=django.utils.timezone.now,
+                editable=False,
+                verbose_name='last bookings modification time'),
+        ),
+    ]
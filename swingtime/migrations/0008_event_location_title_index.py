@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swingtime', '0007_bookinglocation_bookings_modified'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(
+                fields=['location', 'title', 'id'],
+                name='swingtime_evt_loc_title_idx'),
+        ),
+    ]
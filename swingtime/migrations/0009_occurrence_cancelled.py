@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('swingtime', '0008_event_location_title_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='occurrence',
+            name='cancelled',
+            field=models.BooleanField(
+                default=False, editable=False, verbose_name='cancelled'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from __future__ import print_function, unicode_literals
 
+import pickle
+import uuid
 from datetime import date, datetime, timedelta
+from threading import local
 
 from dateutil import rrule
 from django.conf import settings
@@ -8,7 +11,8 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import (GenericForeignKey,
                                                 GenericRelation)
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, TruncMonth
 from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.timezone import now as datetime_now
@@ -17,7 +21,10 @@ from django.utils.translation import ugettext_lazy as _
 from places.models import Room
 from webcal.utils import make_vevent_list
 
-from .utils import force_aware, force_naive
+from . import cache, libvevent
+from .conf import settings as swingtime_settings
+from .utils import (OccurrenceURLs, force_aware, force_naive, merge_by_start,
+                    occurrence_stamp)
 
 __all__ = (
     'Note',
@@ -25,6 +32,8 @@ __all__ = (
     'Event',
     'Occurrence',
     'create_event',
+    'materialize_recurrences',
+    'record_bookings_change',
     'BookingLocation',
 )
 
@@ -59,11 +68,63 @@ class Note(models.Model):
 #===============================================================================
 
 
+# the booking locations resolved by slug in this process, with the cache
+# epoch they were resolved in (see ``BookingLocation_Manager.resolve_slug``).
+_locations_by_slug = (None, {})
+LOCATION_EPOCH_KEY = cache.make_key('location-epoch')
+
+
 class BookingLocation_Manager(models.Manager):
     def get_by_slug(self, slug):
-        return self.get(
+        return self.select_related('location').get(
             active=True, location__active=True, location__slug=slug)
 
+    def resolve_slug(self, slug):
+        """
+        Returns ``get_by_slug(slug)``, with its ``Room``, from a process-local
+        map or the shared swingtime cache when possible: a location found in
+        either costs a single cache lookup (of the current cache epoch) and
+        no query. Each call returns a new instance.
+
+        The resolved locations are discarded whenever a booking location or
+        a room is saved or deleted (see ``invalidate_slugs``). The bookings
+        changes do not save the location, so use ``get_by_slug`` where an
+        up to date ``bookings_modified`` matters.
+        """
+        global _locations_by_slug
+        timeout = swingtime_settings.LOCATION_CACHE_TIMEOUT
+        if timeout == 0:
+            return self.get_by_slug(slug)
+
+        shared = cache.get_cache()
+        epoch = shared.get(LOCATION_EPOCH_KEY)
+        if epoch is None:
+            shared.add(LOCATION_EPOCH_KEY, uuid.uuid4().hex, None)
+            epoch = shared.get(LOCATION_EPOCH_KEY)
+        local_epoch, local = _locations_by_slug
+        if local_epoch != epoch:
+            local = {}
+            _locations_by_slug = (epoch, local)
+
+        data = local.get(slug)
+        if data is None:
+            key = cache.make_key('location-slug', epoch, slug)
+            data = shared.get(key)
+            if data is None:
+                data = pickle.dumps(self.get_by_slug(slug), -1)
+                shared.set(key, data, timeout)
+            local[slug] = data
+        return pickle.loads(data)
+
+    def invalidate_slugs(self):
+        """
+        Discard the locations resolved by slug, in this process and (by
+        starting a new cache epoch) in all the processes sharing the cache.
+        """
+        global _locations_by_slug
+        _locations_by_slug = (None, {})
+        cache.get_cache().set(LOCATION_EPOCH_KEY, uuid.uuid4().hex, None)
+
 
 @python_2_unicode_compatible
 class BookingLocation(models.Model):
@@ -75,6 +136,12 @@ class BookingLocation(models.Model):
         auto_now_add=True, editable=False, verbose_name='creation time')
     modified = models.DateTimeField(
         auto_now=True, editable=False, verbose_name='last modification time')
+    # the last change to the events, occurrences or notes booked here
+    # (see ``record_bookings_change``).
+    bookings_modified = models.DateTimeField(
+        default=datetime_now,
+        editable=False,
+        verbose_name='last bookings modification time')
 
     location = models.OneToOneField(Room, on_delete=models.PROTECT)
 
@@ -114,9 +181,178 @@ class BookingLocation(models.Model):
                 make_vevent_list(self.location.office, include_set_events))
         return results
 
+    def _calendar_events_key(self, kind, include_set_events):
+        return cache.make_key(kind, self.pk, int(bool(include_set_events)))
+
+    def _build_calendar_events(self, include_set_events):
+        index = libvevent.VEventIndex(self.calendar_events(include_set_events))
+        self._record_calendar_events_state(include_set_events, index.vevents)
+        return index
+
+    def _record_calendar_events_state(self, include_set_events, events):
+        # the state is kept until the content changes: it outlives the cached
+        # vevent lists, so that their periodic rebuilds keep it unchanged.
+        # Its third item is the time the content was last checked.
+        key = self._calendar_events_key('vevent-state', include_set_events)
+        digest = libvevent.content_digest(events)
+        now = datetime_now()
+        state = cache.get_cache().get(key)
+        if state is None or state[0] != digest:
+            state = (digest, now, now)
+        else:
+            state = (digest, state[1], now)
+        cache.get_cache().set(key, state, None)
+        return state
+
+    @staticmethod
+    def _calendar_events_state_expired(state):
+        timeout = swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT
+        if state is None or state[2] is None:
+            return True
+        if timeout is None:
+            return False
+        return datetime_now() >= state[2] + timedelta(seconds=timeout)
+
+    def cached_calendar_events(self, include_set_events=True):
+        """
+        Return the vevent list for this location, as a
+        ``libvevent.VEventIndex``, from the swingtime cache. It is computed
+        at most once per SCHEDULED_EVENTS_CACHE_TIMEOUT across all the
+        processes sharing the cache.
+        """
+        return cache.get_or_compute(
+            self._calendar_events_key('vevent-index', include_set_events),
+            lambda: self._build_calendar_events(include_set_events),
+            swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT)
+
+    def calendar_events_state(self, include_set_events=True):
+        """
+        Return the (digest, modified) state of the vevent list for this
+        location: a digest of its content (see ``libvevent.content_digest``)
+        and the time that content was first seen. Both stay the same across
+        the rebuilds of the cached list until the content changes.
+
+        The state is checked against the cached list once it is older than
+        SCHEDULED_EVENTS_CACHE_TIMEOUT, the list being rebuilt first if it
+        has expired too.
+        """
+        key = self._calendar_events_key('vevent-state', include_set_events)
+        state = cache.get_cache().get(key)
+        if self._calendar_events_state_expired(state):
+            # a rebuild of the cached list records the state itself.
+            index = self.cached_calendar_events(include_set_events)
+            state = cache.get_cache().get(key)
+            # unless it was evicted or invalidated, a list that was not
+            # rebuilt has the content last checked: it is checked again
+            # once it expires.
+            if state is None or state[2] is None:
+                state = self._record_calendar_events_state(
+                    include_set_events, index.vevents)
+        return state[:2]
+
+    def calendar_events_modified(self, include_set_events=True):
+        """
+        Return the time the content of the vevent list for this location
+        last changed (see ``calendar_events_state``).
+        """
+        return self.calendar_events_state(include_set_events)[1]
+
+    def cached_calendar_records(self, include_set_events=True):
+        """
+        Return the vevent list for this location reduced to display records
+        (``libvevent.EventRecord``), as a ``libvevent.VEventIndex``, from the
+        swingtime cache. The records are keyed by the digest of the vevent
+        list, so that they are rebuilt along with it.
+        """
+        digest = self.calendar_events_state(include_set_events)[0]
+        return cache.get_or_compute(
+            cache.make_key('record-index', self.pk,
+                           int(bool(include_set_events)), digest),
+            lambda: libvevent.VEventIndex(
+                libvevent.records_from_vevents(
+                    self.cached_calendar_events(include_set_events))),
+            swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT)
+
+    def invalidate_calendar_events(self):
+        """
+        Discard the cached vevent lists for this location, e.g., when the
+        external schedules for the room have changed.
+        """
+        cache.get_cache().delete_many([
+            self._calendar_events_key('vevent-index', include_set_events)
+            for include_set_events in (True, False)
+        ])
+        # keep the content and its time, but have them checked again.
+        for include_set_events in (True, False):
+            key = self._calendar_events_key('vevent-state', include_set_events)
+            state = cache.get_cache().get(key)
+            if state is not None:
+                cache.get_cache().set(key, (state[0], state[1], None), None)
+        cache.bump_location_version(self.pk)
+
+    @property
+    def version(self):
+        """
+        The current version of the bookings at this location; it changes
+        whenever its events, occurrences, notes or scheduled events change.
+        """
+        return cache.location_version(self.pk)
+
+    def cache_key(self, *parts):
+        """
+        Build a cache key from the given parts, scoped to the current version
+        of the bookings at this location.
+        """
+        return cache.location_key(self.pk, *parts)
+
     @property
     def scheduled_events(self):
-        return self.calendar_events()
+        return self.cached_calendar_events()
+
+    @property
+    def scheduled_records(self):
+        return self.cached_calendar_records()
+
+
+#===============================================================================
+class EventQuerySet(models.QuerySet):
+
+    #---------------------------------------------------------------------------
+    def with_occurrence_stats(self, now=None):
+        '''
+        Annotates the events with the number of their stored occurrences
+        (``occurrence_count``) and the start of the next one at or after
+        ``now`` (``next_start``, ``None`` if there is none). Both are computed
+        by correlated subqueries, so that no grouping of the events is needed;
+        use ``add_virtual_occurrence_stats`` on the fetched events to count
+        their virtual occurrences too.
+        '''
+        occurrences = Occurrence.objects.filter(
+            event=models.OuterRef('pk'), cancelled=False).order_by()
+        return self.annotate(
+            occurrence_count=Coalesce(
+                models.Subquery(
+                    occurrences.values('event').annotate(
+                        count=models.Count('pk')).values('count'),
+                    output_field=models.IntegerField()), 0),
+            next_start=models.Subquery(
+                occurrences.filter(start_time__gte=now or datetime_now())
+                .order_by('start_time').values('start_time')[:1],
+                output_field=models.DateTimeField()))
+
+    #---------------------------------------------------------------------------
+    def after(self, title, pk):
+        '''
+        Returns the events following (``title``, ``pk``) in (title, id) order,
+        in that order: a keyset page of the events starts where the previous
+        one ended, without an OFFSET.
+        '''
+        return self.filter(
+            models.Q(title__gt=title)
+            | models.Q(title=title, pk__gt=pk)).order_by('title', 'pk')
+
+
+#===============================================================================
 
 
 @python_2_unicode_compatible
@@ -134,16 +370,48 @@ class Event(models.Model):
         _('description'), max_length=100, blank=True)
     notes = GenericRelation(Note, verbose_name=_('notes'))
 
+    # Stored recurrence (see ``add_occurrences``): an RFC 5545 DTSTART/RRULE
+    # text in naive local time, the length of each occurrence, and the point
+    # up to which the series has been written out as ``Occurrence`` rows.
+    # Instances starting on or after ``materialized_until`` are expanded on
+    # read by ``OccurrenceManager.virtual_occurrences``.
+    recurrence = models.TextField(
+        _('recurrence rule'), blank=True, editable=False)
+    duration = models.DurationField(
+        _('occurrence duration'), null=True, blank=True, editable=False)
+    materialized_until = models.DateTimeField(
+        _('materialized until'), null=True, blank=True, editable=False)
+
+    objects = EventQuerySet.as_manager()
+
     #===========================================================================
     class Meta:
         verbose_name = _('event')
         verbose_name_plural = _('events')
         ordering = ('title', )
+        indexes = [
+            models.Index(
+                fields=['location', 'title', 'id'],
+                name='swingtime_evt_loc_title_idx'),
+        ]
 
     #---------------------------------------------------------------------------
     def __str__(self):
         return self.title
 
+    #---------------------------------------------------------------------------
+    def save(self, *args, **kws):
+        old_location_id = None
+        if not self._state.adding:
+            old_location_id = Event.objects.filter(pk=self.pk).values_list(
+                'location_id', flat=True).first()
+        super(Event, self).save(*args, **kws)
+        if old_location_id is not None and \
+           old_location_id != self.location_id:
+            # keep the denormalized ``Occurrence.location`` in sync.
+            self.occurrence_set.update(location=self.location_id)
+            record_bookings_change(old_location_id)
+
     #---------------------------------------------------------------------------
     def get_absolute_url(self):
         return reverse(
@@ -166,12 +434,27 @@ class Event(models.Model):
         If both ``count`` and ``until`` entries are missing from ``rrule_params``,
         only a single ``Occurrence`` instance will be created using the exact
         ``start_time`` and ``end_time`` values.
+
+        The occurrences are built in memory and written using batched inserts
+        (see swingtime_settings.OCCURRENCE_BATCH_SIZE) in a single transaction.
+        Returns the list of newly created ``Occurrence`` instances.
+
+        If swingtime_settings.RECURRENCE_HORIZON is set and the event does not
+        already have a stored recurrence, the rule is stored on the event and
+        only the instances starting within the horizon are created; the rest
+        are expanded on read (see ``virtual_occurrences``).
         '''
         rrule_params.setdefault('freq', rrule.DAILY)
+        horizon = swingtime_settings.RECURRENCE_HORIZON
 
         if 'count' not in rrule_params and 'until' not in rrule_params:
-            self.occurrence_set.create(
-                start_time=start_time, end_time=end_time)
+            occurrences = [
+                Occurrence(
+                    event=self,
+                    location_id=self.location_id,
+                    start_time=start_time,
+                    end_time=end_time)
+            ]
         else:
             # weird things can happen with timezones here if we hit
             #   a daylight savings time transition...
@@ -181,40 +464,264 @@ class Event(models.Model):
             if 'until' in rrule_params:
                 rrule_params['until'] = force_naive(rrule_params['until'])
             delta = end_time - start_time
+            rule = rrule.rrule(dtstart=start_time, **rrule_params)
+
+            if horizon is not None and not self.recurrence:
+                # expand the instances within the horizon before advancing
+                # materialized_until, which excludes those preceding it.
+                until = datetime_now() + horizon
+                self.recurrence = str(rule)
+                self.duration = delta
+                self.materialized_until = None
+                occurrences = self._expand_recurrence(rule, end=until)
+                self.materialized_until = until
+                with transaction.atomic():
+                    record_bookings_change(self.location_id)
+                    Event.objects.filter(pk=self.pk).update(
+                        recurrence=self.recurrence,
+                        duration=self.duration,
+                        materialized_until=self.materialized_until)
+                    return Occurrence.objects.bulk_create(
+                        occurrences,
+                        batch_size=swingtime_settings.OCCURRENCE_BATCH_SIZE)
+
+            occurrences = [
+                Occurrence(
+                    event=self,
+                    location_id=self.location_id,
+                    start_time=force_aware(ev),
+                    end_time=force_aware(ev + delta)) for ev in rule
+            ]
+
+        with transaction.atomic():
+            # bulk_create() does not send post_save.
+            record_bookings_change(self.location_id)
+            return Occurrence.objects.bulk_create(
+                occurrences,
+                batch_size=swingtime_settings.OCCURRENCE_BATCH_SIZE)
+
+    #---------------------------------------------------------------------------
+    def get_recurrence(self):
+        '''
+        Return the stored ``rrule.rrule`` for this event (in naive local time),
+        or ``None`` if the event has no stored recurrence.
+        '''
+        if not self.recurrence:
+            return None
+        return rrule.rrulestr(self.recurrence)
 
-            for ev in rrule.rrule(dtstart=start_time, **rrule_params):
-                ev_start = force_aware(ev)
-                ev_end = force_aware(ev + delta)
-                self.occurrence_set.create(
-                    start_time=ev_start, end_time=ev_end)
+    #---------------------------------------------------------------------------
+    def _expand_recurrence(self, rule, start=None, end=None, exceptions=()):
+        '''
+        Build unsaved ``Occurrence`` instances for the instances of ``rule``
+        that start on or after ``materialized_until``, overlap the half-open
+        interval [``start``, ``end``) and are not replaced by a stored
+        occurrence whose ``original_start_time`` is in ``exceptions``.
+        '''
+        bounds = [
+            force_naive(dt)
+            for dt in (self.materialized_until, start and start - self.duration)
+            if dt is not None
+        ]
+        after = max(bounds) if bounds else datetime.min
+        before = datetime.max if end is None else force_naive(end)
+
+        occurrences = []
+        for ev in rule.between(after, before, inc=True):
+            ev_start = force_aware(ev)
+            ev_end = force_aware(ev + self.duration)
+            if self.materialized_until and ev_start < self.materialized_until:
+                continue
+            if (start is not None and ev_end <= start) or \
+               (end is not None and ev_start >= end):
+                continue
+            if ev_start in exceptions:
+                continue
+            occurrences.append(
+                Occurrence(
+                    event=self,
+                    location_id=self.location_id,
+                    start_time=ev_start,
+                    end_time=ev_end,
+                    original_start_time=ev_start))
+        return occurrences
+
+    #---------------------------------------------------------------------------
+    def virtual_occurrences(self, start=None, end=None):
+        '''
+        Return the unsaved ``Occurrence`` instances of the stored recurrence
+        which have not been materialized and overlap [``start``, ``end``).
+        '''
+        rule = self.get_recurrence()
+        if rule is None:
+            return []
+        exceptions = self.occurrence_set.filter(
+            original_start_time__isnull=False)
+        if self.materialized_until is not None:
+            exceptions = exceptions.filter(
+                original_start_time__gte=self.materialized_until)
+        exceptions = set(
+            exceptions.values_list('original_start_time', flat=True))
+        return self._expand_recurrence(rule, start, end, exceptions)
+
+    #---------------------------------------------------------------------------
+    def materialize(self, until):
+        '''
+        Store the instances of the recurrence starting before ``until`` as
+        ``Occurrence`` rows, and advance ``materialized_until``.
+
+        Returns the list of newly created ``Occurrence`` instances.
+        '''
+        if not self.recurrence or (self.materialized_until and
+                                   until <= self.materialized_until):
+            return []
+
+        with transaction.atomic():
+            record_bookings_change(self.location_id)
+            occurrences = Occurrence.objects.bulk_create(
+                self.virtual_occurrences(end=until),
+                batch_size=swingtime_settings.OCCURRENCE_BATCH_SIZE)
+            self.materialized_until = until
+            Event.objects.filter(pk=self.pk).update(materialized_until=until)
+        return occurrences
+
+    #---------------------------------------------------------------------------
+    def get_virtual_occurrence(self, original_start):
+        '''
+        Return the virtual occurrence of the stored recurrence whose original
+        start time is within the second starting at ``original_start`` (see
+        ``utils.occurrence_stamp``), or ``None`` if there is no such instance
+        or it is stored (e.g., edited or cancelled).
+        '''
+        end = original_start + timedelta(seconds=1)
+        for occurrence in self.virtual_occurrences(original_start, end):
+            if original_start <= occurrence.original_start_time < end:
+                return occurrence
+        return None
 
     #---------------------------------------------------------------------------
     def upcoming_occurrences(self):
         '''
-        Return all occurrences that are set to start on or after the current
-        time.
+        Return a list of all the occurrences that are set to start on or after
+        the current time, stored and virtual, in start order.
         '''
-        return self.occurrence_set.filter(start_time__gte=datetime_now())
+        now = datetime_now()
+        return list(
+            merge_by_start(
+                self.occurrence_set.filter(
+                    start_time__gte=now, cancelled=False).order_by(
+                        'start_time', 'end_time'),
+                [
+                    o for o in self.virtual_occurrences(start=now)
+                    if o.start_time >= now
+                ]))
 
     #---------------------------------------------------------------------------
     def next_occurrence(self):
         '''
-        Return the single occurrence set to start on or after the current time
-        if available, otherwise ``None``.
+        Return the single occurrence (stored or virtual) set to start on or
+        after the current time if available, otherwise ``None``.
         '''
-        upcoming = self.upcoming_occurrences()
-        return upcoming and upcoming[0] or None
+        now = datetime_now()
+        stored = self.occurrence_set.filter(
+            start_time__gte=now, cancelled=False).order_by(
+                'start_time', 'end_time').first()
+        # only the instances starting before the next stored one matter.
+        for occurrence in self.virtual_occurrences(
+                now, stored and stored.start_time):
+            if occurrence.start_time >= now:
+                return occurrence
+        return stored
 
     #---------------------------------------------------------------------------
     def daily_occurrences(self, dt=None):
         '''
         Convenience method wrapping ``Occurrence.objects.daily_occurrences``.
         '''
-        return Occurrence.objects.daily_occurrences(dt=dt, event=self)
+        return Occurrence.objects.daily_occurrences(
+            self.location_id, dt=dt, event=self)
+
+
+#===============================================================================
+class OccurrenceQuerySet(models.QuerySet):
+
+    #---------------------------------------------------------------------------
+    def overlapping(self, location, start, end):
+        '''
+        Returns the occurrences for ``location`` that have any overlap with
+        the half-open interval [``start``, ``end``). Either bound may be
+        ``None``, for no bound.
+
+        The canonical ``start_time < end AND end_time > start`` predicate is
+        used so the (location, start_time) index can serve the range scan.
+        Cancelled occurrences are left out.
+        '''
+        qs = self.filter(location=location, cancelled=False)
+        if end is not None:
+            qs = qs.filter(start_time__lt=end)
+        if start is not None:
+            qs = qs.filter(end_time__gt=start)
+        return qs
+
+    #---------------------------------------------------------------------------
+    def display_rows(self, location, urls=None):
+        '''
+        Returns an iterator of ``libvevent.EventRecord`` for the occurrences
+        at ``location``, in start order, reading only the columns shown in
+        the calendars instead of building ``Occurrence`` and ``Event``
+        instances. The record URLs are built by ``urls`` (by default an
+        ``OccurrenceURLs`` for ``location``).
+        '''
+        if urls is None:
+            urls = OccurrenceURLs(location)
+        name = '{}'.format(location)
+        rows = self.order_by('start_time', 'end_time').values_list(
+            'pk', 'event_id', 'start_time', 'end_time', 'event__title')
+        for pk, event_id, start_time, end_time, title in rows.iterator():
+            yield libvevent.EventRecord(start_time, end_time, title, name,
+                                        urls.for_ids(event_id, pk))
+
+    #---------------------------------------------------------------------------
+    def month_summary(self, location, start, end):
+        '''
+        Returns a list of dictionaries summarizing, in the database, the
+        occurrences for ``location`` starting in [``start``, ``end``) by month
+        (in the current timezone), in order. Each has the ``month`` (a
+        datetime), the ``count`` of occurrences, the number of distinct
+        ``events``, and the ``first_start``, ``first_title``, ``last_start``
+        and ``last_title`` of the first and last occurrences in the month.
+        '''
+        qs = self.filter(
+            location=location,
+            start_time__gte=start,
+            start_time__lt=end,
+            cancelled=False)
+        months = list(
+            qs.annotate(month=TruncMonth('start_time')).values('month')
+            .annotate(
+                count=models.Count('pk'),
+                events=models.Count('event', distinct=True),
+                first_start=models.Min('start_time'),
+                last_start=models.Max('start_time')).order_by('month'))
+
+        # the titles of the first and last occurrences, in a single query
+        starts = set(m['first_start'] for m in months)
+        starts.update(m['last_start'] for m in months)
+        firsts, lasts = {}, {}
+        for start_time, title in qs.filter(start_time__in=starts).order_by(
+                'start_time', 'end_time', 'pk').values_list(
+                    'start_time', 'event__title'):
+            firsts.setdefault(start_time, title)
+            lasts[start_time] = title
+
+        for m in months:
+            m['first_title'] = firsts.get(m['first_start'])
+            m['last_title'] = lasts.get(m['last_start'])
+        return months
 
 
 #===============================================================================
-class OccurrenceManager(models.Manager):
+class OccurrenceManager(models.Manager.from_queryset(OccurrenceQuerySet)):
 
     #---------------------------------------------------------------------------
     def daily_occurrences(self, location, dt=None, event=None):
@@ -229,20 +736,77 @@ class OccurrenceManager(models.Manager):
         '''
         dt = dt or datetime_now()
         start = datetime(dt.year, dt.month, dt.day, tzinfo=dt.tzinfo)
-        end = start.replace(hour=23, minute=59, second=59)
-        qs = self.filter(
-            models.Q(
-                start_time__gte=start,
-                start_time__lte=end,
-            ) | models.Q(
-                end_time__gte=start,
-                end_time__lte=end,
-            ) | models.Q(start_time__lt=start, end_time__gt=end),
-            event__location=location,
-        )
+        qs = self.overlapping(location, start, start + timedelta(days=1))
 
         return qs.filter(event=event) if event else qs
 
+    #---------------------------------------------------------------------------
+    def display_occurrences(self, location, start, end):
+        '''
+        Returns an iterator of ``libvevent.EventRecord`` for the stored and
+        virtual occurrences at ``location`` overlapping the half-open interval
+        [``start``, ``end``), in start order (see ``display_rows``).
+        '''
+        urls = OccurrenceURLs(location)
+        name = '{}'.format(location)
+        virtual = [
+            libvevent.EventRecord(o.start_time, o.end_time, o.title, name,
+                                  urls.for_ids(o.event_id, None,
+                                               o.original_start_time))
+            for o in self.virtual_occurrences(location, start, end)
+        ]
+        return merge_by_start(
+            self.overlapping(location, start, end).display_rows(
+                location, urls), virtual)
+
+    #---------------------------------------------------------------------------
+    def virtual_occurrences(self, location, start=None, end=None):
+        '''
+        Returns a sorted list of unsaved ``Occurrence`` instances for the
+        stored recurrences at ``location`` that have not been materialized
+        and overlap the half-open interval [``start``, ``end``).
+
+        These complement the stored rows returned by ``overlapping``.
+        '''
+        events = Event.objects.filter(location=location).exclude(recurrence='')
+        if end is not None:
+            events = events.filter(
+                models.Q(materialized_until__isnull=True)
+                | models.Q(materialized_until__lt=end))
+        return self.expand_recurrences(events, start, end)
+
+    #---------------------------------------------------------------------------
+    def expand_recurrences(self, events, start=None, end=None):
+        '''
+        Returns a sorted list of unsaved ``Occurrence`` instances for the
+        stored recurrences of ``events`` that have not been materialized and
+        overlap the half-open interval [``start``, ``end``), reading the
+        occurrences replacing their instances in a single query.
+        '''
+        events = [e for e in events if e.recurrence]
+        if not events:
+            return []
+
+        # stored rows standing in for instances past the horizon
+        exceptions = dict((e.pk, set()) for e in events)
+        for event_id, dt in self.filter(
+                models.Q(event__materialized_until__isnull=True)
+                | models.Q(
+                    original_start_time__gte=models.F(
+                        'event__materialized_until')),
+                event__in=[e.pk for e in events],
+                original_start_time__isnull=False).values_list(
+                    'event_id', 'original_start_time').order_by():
+            exceptions[event_id].add(dt)
+
+        occurrences = []
+        for event in events:
+            occurrences.extend(
+                event._expand_recurrence(event.get_recurrence(), start, end,
+                                         exceptions[event.pk]))
+        occurrences.sort(key=lambda o: (o.start_time, o.end_time))
+        return occurrences
+
 
 #===============================================================================
 
@@ -260,6 +824,22 @@ class Occurrence(models.Model):
         on_delete=models.CASCADE,
         verbose_name=_('event'),
         editable=False)
+    # denormalized copy of ``event.location``, so calendar queries do not
+    # need to join against ``Event``.
+    location = models.ForeignKey(
+        BookingLocation,
+        on_delete=models.CASCADE,
+        verbose_name=_('location'),
+        editable=False)
+    # for occurrences of a stored recurrence, the start time of the rule
+    # instance this row stands for.
+    original_start_time = models.DateTimeField(
+        _('original start time'), null=True, blank=True, editable=False)
+    # a cancelled instance of a stored recurrence (see ``cancel``): the row
+    # only keeps it from being expanded again, and is left out of the
+    # calendars.
+    cancelled = models.BooleanField(
+        _('cancelled'), default=False, editable=False)
     notes = GenericRelation(Note, verbose_name=_('notes'))
 
     objects = OccurrenceManager()
@@ -270,19 +850,72 @@ class Occurrence(models.Model):
         verbose_name_plural = _('occurrences')
         ordering = ('start_time', 'end_time')
         base_manager_name = 'objects'
+        indexes = [
+            models.Index(
+                fields=['location', 'start_time'],
+                name='swingtime_occ_loc_start_idx'),
+            models.Index(
+                fields=['location', 'end_time'],
+                name='swingtime_occ_loc_end_idx'),
+        ]
 
     #---------------------------------------------------------------------------
     def __str__(self):
         return '%s: %s' % (self.title, self.start_time.isoformat())
 
+    #---------------------------------------------------------------------------
+    def save(self, *args, **kws):
+        self.location_id = self.event.location_id
+        super(Occurrence, self).save(*args, **kws)
+
     #---------------------------------------------------------------------------
     def get_absolute_url(self):
+        if self.pk is None:
+            # a virtual occurrence of a stored recurrence.
+            if self.original_start_time is None:
+                return self.event.get_absolute_url()
+            return reverse(
+                'swingtime-virtual-occurrence',
+                args=[self.location.slug,
+                      str(self.event.id),
+                      occurrence_stamp(self.original_start_time)])
         return reverse(
             'swingtime-occurrence',
             args=[self.location.slug,
                   str(self.event.id),
                   str(self.id)])
 
+    #---------------------------------------------------------------------------
+    def get_delete_url(self):
+        if self.pk is None:
+            return reverse(
+                'swingtime-virtual-occurrence-delete',
+                args=[self.location.slug,
+                      str(self.event.id),
+                      occurrence_stamp(self.original_start_time)])
+        return reverse(
+            'swingtime-occurrence-delete',
+            args=[self.location.slug,
+                  str(self.event.id),
+                  str(self.id)])
+
+    #---------------------------------------------------------------------------
+    def cancel(self):
+        '''
+        Remove this occurrence from the calendars. An instance of a stored
+        recurrence which has not been materialized (a virtual occurrence, or
+        the stored row replacing it) is saved as cancelled, so that it is not
+        expanded again; any other occurrence is deleted.
+        '''
+        materialized_until = self.event.materialized_until
+        if self.original_start_time is not None and (
+                materialized_until is None
+                or self.original_start_time >= materialized_until):
+            self.cancelled = True
+            self.save()
+        else:
+            self.delete()
+
     #---------------------------------------------------------------------------
     def __cmp__(self, other):
         return cmp(self.start_time, other.start_time)
@@ -297,11 +930,39 @@ class Occurrence(models.Model):
 #     def event_type(self):
 #         return self.event.event_type
 
-#---------------------------------------------------------------------------
 
-    @property
-    def location(self):
-        return self.event.location
+#-------------------------------------------------------------------------------
+_pending_changes = local()
+
+
+def record_bookings_change(location):
+    '''
+    Record that the bookings at ``location`` (a ``BookingLocation`` or its
+    primary key) have changed, by updating its ``bookings_modified`` time and
+    starting a new version of its bookings (see ``BookingLocation.version``).
+
+    This is called by the signal handlers in ``swingtime.signals``, and should
+    be called by anything changing bookings without sending signals (e.g.,
+    ``bulk_create`` or ``QuerySet.update``), or by external schedule sources.
+    Within a transaction, the update is made once per location when the
+    transaction commits, so that deleting an event with many occurrences does
+    not update the location for each of them.
+    '''
+    pending = getattr(_pending_changes, 'location_ids', None)
+    if pending is None:
+        pending = _pending_changes.location_ids = set()
+    pending.add(getattr(location, 'pk', location))
+    transaction.on_commit(_save_bookings_changes)
+
+
+def _save_bookings_changes():
+    location_ids = getattr(_pending_changes, 'location_ids', None)
+    if location_ids:
+        _pending_changes.location_ids = set()
+        BookingLocation.objects.filter(pk__in=location_ids).update(
+            bookings_modified=datetime_now())
+        for location_id in location_ids:
+            cache.bump_location_version(location_id)
 
 
 #-------------------------------------------------------------------------------
@@ -358,3 +1019,42 @@ def create_event(
     end_time = end_time or start_time + swingtime_settings.DEFAULT_OCCURRENCE_DURATION
     event.add_occurrences(start_time, end_time, **rrule_params)
     return event
+
+
+#-------------------------------------------------------------------------------
+def add_virtual_occurrence_stats(events, now=None):
+    '''
+    Add the virtual occurrences of the stored recurrences of ``events``,
+    annotated by ``EventQuerySet.with_occurrence_stats`` with the same
+    ``now``, to their ``occurrence_count`` and ``next_start``.
+    '''
+    now = now or datetime_now()
+    events = dict((e.pk, e) for e in events)
+    for occurrence in Occurrence.objects.expand_recurrences(events.values()):
+        event = events[occurrence.event_id]
+        event.occurrence_count += 1
+        if occurrence.start_time >= now and (
+                event.next_start is None
+                or occurrence.start_time < event.next_start):
+            event.next_start = occurrence.start_time
+
+
+#-------------------------------------------------------------------------------
+def materialize_recurrences(until=None):
+    '''
+    Roll the materialization horizon of every stored recurrence forward to
+    ``until``, which defaults to now plus swingtime_settings.RECURRENCE_HORIZON.
+
+    Returns the number of newly created ``Occurrence`` instances.
+    '''
+    if until is None:
+        if swingtime_settings.RECURRENCE_HORIZON is None:
+            return 0
+        until = datetime_now() + swingtime_settings.RECURRENCE_HORIZON
+
+    count = 0
+    events = Event.objects.exclude(recurrence='').filter(
+        materialized_until__lt=until)
+    for event in events:
+        count += len(event.materialize(until))
+    return count
@@ -0,0 +1,134 @@
+'''
+Memoized booking location permissions.
+
+The permissions of a user on the booking locations are looked up at most
+once per permission: the object permissions (with django-guardian, when
+installed) are prefetched for all the locations at once, and the answers
+are kept on the user object, like the permission cache of Django's
+``ModelBackend``. Since ``request.user`` is created for each request, the
+memoized permissions last for the request, its views and its templates.
+
+'''
+#######################
+from __future__ import print_function, unicode_literals
+
+from .models import BookingLocation
+
+#######################
+
+try:
+    import guardian
+except ImportError:
+    use_guardian = False
+else:
+    use_guardian = True
+
+if use_guardian:
+    from guardian.core import ObjectPermissionChecker
+
+# the user attribute holding the memoized permissions.
+USER_ATTRIBUTE = '_swingtime_permissions'
+
+#===============================================================================
+
+
+class LocationPermissions(object):
+    '''
+    The permissions of ``user`` on the booking locations, computed on
+    demand and memoized.
+
+    '''
+
+    #---------------------------------------------------------------------------
+    def __init__(self, user):
+        self.user = user
+        self._global = {}
+        self._object = {}
+        self._locations = {}
+        self._checker = None
+        self._location_ids = None
+
+    #---------------------------------------------------------------------------
+    def has_global_perm(self, perm):
+        '''
+        Return whether the user has the global permission ``perm``.
+        '''
+        if perm not in self._global:
+            self._global[perm] = self.user.has_perm(perm)
+        return self._global[perm]
+
+    #---------------------------------------------------------------------------
+    def _prefetch(self):
+        '''
+        Prefetch the guardian object permissions of the user for all the
+        booking locations; returns the permission checker.
+        '''
+        if self._checker is None:
+            self._checker = ObjectPermissionChecker(self.user)
+            locations = list(BookingLocation.objects.only('pk'))
+            self._location_ids = [location.pk for location in locations]
+            if locations:
+                self._checker.prefetch_perms(locations)
+        return self._checker
+
+    #---------------------------------------------------------------------------
+    def has_object_perm(self, perm, obj):
+        '''
+        Return whether the user has the permission ``perm`` on the booking
+        location ``obj`` itself.
+        '''
+        key = (perm, obj.pk)
+        if key not in self._object:
+            if not use_guardian:
+                self._object[key] = self.user.has_perm(perm, obj)
+            elif not self.user.is_authenticated:
+                self._object[key] = False
+            else:
+                codename = perm.split('.', 1)[-1]
+                self._object[key] = codename in self._prefetch().get_perms(obj)
+        return self._object[key]
+
+    #---------------------------------------------------------------------------
+    def has_perm(self, perm, obj):
+        '''
+        Return whether the user has the permission ``perm``, either globally
+        or on the booking location ``obj``.
+        '''
+        return self.has_global_perm(perm) or self.has_object_perm(perm, obj)
+
+    #---------------------------------------------------------------------------
+    def locations(self, perm):
+        '''
+        Return the queryset of the active booking locations on which the user
+        has the permission ``perm``. The same queryset is returned for each
+        call, so that it is evaluated at most once.
+        '''
+        if perm not in self._locations:
+            if self.has_global_perm(perm):
+                qs = BookingLocation.objects.all()
+            elif use_guardian and self.user.is_authenticated:
+                checker = self._prefetch()
+                codename = perm.split('.', 1)[-1]
+                qs = BookingLocation.objects.filter(pk__in=[
+                    pk for pk in self._location_ids if codename in
+                    checker.get_perms(BookingLocation(pk=pk))
+                ])
+            else:
+                qs = BookingLocation.objects.none()
+            self._locations[perm] = qs.filter(active=True)
+        return self._locations[perm]
+
+
+#-------------------------------------------------------------------------------
+
+
+def get_permissions(user):
+    '''
+    Return the ``LocationPermissions`` of ``user``, memoized on it.
+
+    '''
+    permissions = getattr(user, USER_ATTRIBUTE, None)
+    if permissions is None:
+        permissions = LocationPermissions(user)
+        setattr(user, USER_ATTRIBUTE, permissions)
+    return permissions
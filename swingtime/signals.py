@@ -0,0 +1,62 @@
+'''
+Signal handlers for swingtime; these are connected in
+``SwingtimeConfig.ready``.
+
+'''
+#######################
+from __future__ import print_function, unicode_literals
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from places.models import Room
+
+from . import cache, utils
+from .models import (BookingLocation, Event, Note, Occurrence,
+                     record_bookings_change)
+
+#######################
+
+
+#-------------------------------------------------------------------------------
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+@receiver(post_save, sender=Occurrence)
+@receiver(post_delete, sender=Occurrence)
+def booking_changed(sender, instance, **kws):
+    record_bookings_change(instance.location_id)
+
+
+#-------------------------------------------------------------------------------
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+def note_changed(sender, instance, **kws):
+    location_id = getattr(instance.content_object, 'location_id', None)
+    if location_id is not None:
+        record_bookings_change(location_id)
+
+
+#-------------------------------------------------------------------------------
+@receiver(post_save, sender=BookingLocation)
+@receiver(post_delete, sender=BookingLocation)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def location_changed(sender, instance, **kws):
+    if sender is Room:
+        location_ids = list(
+            BookingLocation.objects.filter(location=instance).values_list(
+                'pk', flat=True))
+    else:
+        location_ids = [instance.pk]
+    # deferred, so that no other request caches the uncommitted state under
+    # the new cache epoch or version.
+    transaction.on_commit(lambda: _locations_changed(location_ids))
+
+
+#-------------------------------------------------------------------------------
+def _locations_changed(location_ids):
+    utils.invalidate_css_class_names()
+    BookingLocation.objects.invalidate_slugs()
+    for location_id in location_ids:
+        cache.bump_location_version(location_id)
@@ -4,7 +4,7 @@ Template tags for swingtime.
 
 from django import template
 
-from ..views import get_location_list
+from ..views import check_permission, get_location_list
 
 #####################################################################
 
@@ -37,3 +37,19 @@ def calendar_list(user, perm='book_can_view'):
     if not perm.startswith(APP_PREFIX):
         perm = APP_PREFIX + perm
     return get_location_list(user, perm)
+
+
+@register.simple_tag
+def has_location_perm(user, perm, location):
+    """
+    {% has_location_perm request.user "book_can_edit" location as can_edit %}
+    {% if can_edit %}
+    ...
+    {% endif %}
+
+    Whether the user has the permission, globally or for the location;
+    the permissions are memoized on the user for the request.
+    """
+    if not perm.startswith(APP_PREFIX):
+        perm = APP_PREFIX + perm
+    return check_permission(user, perm, location)
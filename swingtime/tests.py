@@ -9,7 +9,7 @@ from pprint import pformat, pprint
 
 from django.contrib.auth.models import User
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.utils.timezone import is_aware
 
 from swingtime import utils
@@ -79,8 +79,8 @@ class TableTest(TestCase):
 
     #---------------------------------------------------------------------------
     def table_as_string(self, table):
-        timefmt = '| %-5s'
-        cellfmt = '| %-8s'
+        timefmt = '| %-5s '
+        cellfmt = '| %-8s '
         out = StringIO()
         for tm, cells in table:
             print(timefmt % tm.strftime('%H:%M'), end='', file=out)
@@ -107,7 +107,11 @@ class TableTest(TestCase):
         # pdb.set_trace()
         location = BookingLocation.objects.get(pk=1)
         table = utils.create_timeslot_table(
-            location, dt=self._dt, start_time=start, end_time_delta=etd)
+            location,
+            dt=self._dt,
+            start_time=start,
+            end_time_delta=etd,
+            min_columns=4)
 
         actual = self.table_as_string(table)
         out = 'Expecting:\n%s\nActual:\n%s' % (expect, actual)
@@ -134,6 +138,110 @@ class TableTest(TestCase):
     def test_slot_table_5(self):
         self._do_test((16, 30), (16, 30), expected_table_5)
 
+    #---------------------------------------------------------------------------
+    def test_slot_table_items(self):
+        location = BookingLocation.objects.get(pk=1)
+        dtstart = utils.force_aware(datetime.combine(self._dt, time(15)))
+        table = utils.create_timeslot_table(
+            location,
+            dt=self._dt,
+            items=Occurrence.objects.daily_occurrences(location, self._dt),
+            start_time=time(15),
+            end_time_delta=utils.force_aware(
+                datetime.combine(self._dt, time(18))) - dtstart)
+        self.assertEqual(self.table_as_string(table), expected_table_1)
+
+    #---------------------------------------------------------------------------
+    def test_slot_table_off_grid(self):
+        from swingtime import libvevent
+        location = BookingLocation.objects.get(pk=1)
+        dtstart = utils.force_aware(datetime.combine(self._dt, time(9)))
+        items = [
+            libvevent.EventRecord(dtstart + timedelta(minutes=10),
+                                  dtstart + timedelta(minutes=20), 'kilo',
+                                  'Room', None),
+            libvevent.EventRecord(dtstart + timedelta(minutes=35),
+                                  dtstart + timedelta(minutes=50), 'lima',
+                                  'Room', None),
+        ]
+        kws = dict(
+            dt=self._dt,
+            items=items,
+            start_time=time(9),
+            end_time_delta=timedelta(minutes=45),
+            min_columns=2,
+            css_class_cycles=None)
+
+        table = utils.create_timeslot_table(location, **kws)
+        self.assertEqual(
+            [[cell.title if cell else '' for cell in cells]
+             for tm, cells in table],
+            [['kilo', ''], ['kilo', ''], ['lima', ''], ['lima', '']])
+
+        table = utils.create_timeslot_table(
+            location, row_policy=utils.match_grid, **kws)
+        self.assertFalse(any(any(cells) for tm, cells in table))
+
+    #---------------------------------------------------------------------------
+    def test_occurrence_urls(self):
+        location = BookingLocation.objects.get(pk=1)
+        urls = utils.OccurrenceURLs(location)
+        occurrences = list(Occurrence.objects.filter(location=location))
+        self.assertTrue(occurrences)
+        with self.assertNumQueries(0):
+            built = [urls(o) for o in occurrences]
+        self.assertEqual(built, [o.get_absolute_url() for o in occurrences])
+
+        virtual = Occurrence(
+            event=occurrences[0].event,
+            location_id=location.pk,
+            start_time=occurrences[0].start_time,
+            end_time=occurrences[0].end_time)
+        self.assertEqual(urls(virtual), occurrences[0].event.get_absolute_url())
+        virtual.original_start_time = virtual.start_time
+        self.assertEqual(urls(virtual), virtual.get_absolute_url())
+        self.assertNotEqual(urls(virtual),
+                            occurrences[0].event.get_absolute_url())
+
+    #---------------------------------------------------------------------------
+    def test_display_rows(self):
+        location = BookingLocation.objects.get(pk=1)
+        occurrences = Occurrence.objects.filter(location=location)
+        expected = [(o.start_time, o.end_time, o.title, o.get_absolute_url())
+                    for o in occurrences.order_by('start_time', 'end_time')]
+        self.assertTrue(expected)
+        name = '{}'.format(location)
+        with self.assertNumQueries(1):
+            rows = list(occurrences.display_rows(location))
+        self.assertEqual(
+            [(r.start_time, r.end_time, r.title, r.get_absolute_url())
+             for r in rows], expected)
+        self.assertEqual(set(r.location for r in rows), set([name]))
+
+    #---------------------------------------------------------------------------
+    def test_week_table(self):
+        import calendar
+        location = BookingLocation.objects.get(pk=1)
+        start = time(15)
+        etd = utils.force_aware(datetime.combine(self._dt, time(18))) - \
+            utils.force_aware(datetime.combine(self._dt, start))
+        week = utils.create_week_timeslot_table(
+            location, dt=self._dt, start_time=start, end_time_delta=etd)
+
+        days = [dt.date() for dt, cells in week[0][1]]
+        self.assertEqual(len(days), 7)
+        self.assertEqual(days[0].weekday(), calendar.firstweekday())
+        self.assertIn(self._dt.date(), days)
+
+        # the day of the fixture occurrences is as in the daily table
+        i = days.index(self._dt.date())
+        table = [day_rows[i] for tm, day_rows in week]
+        self.assertEqual(self.table_as_string(table), expected_table_1)
+        for j in range(7):
+            if j != i:
+                self.assertFalse(
+                    any(any(day_rows[j][1]) for tm, day_rows in week))
+
 
 #===============================================================================
 class NewEventFormTest(TestCase):
@@ -172,6 +280,961 @@ class NewEventFormTest(TestCase):
                                             target_dt))
 
 
+#===============================================================================
+class OverlappingTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def _titles(self, start, end):
+        location = BookingLocation.objects.get(pk=1)
+        qs = Occurrence.objects.overlapping(
+            location, utils.force_aware(start), utils.force_aware(end))
+        return sorted(o.title for o in qs)
+
+    #---------------------------------------------------------------------------
+    def test_overlapping(self):
+        self.assertEqual(
+            self._titles(
+                datetime(2008, 12, 11, 16), datetime(2008, 12, 11, 16, 15)),
+            ['alpha', 'bravo', 'foxtrot'])
+
+    #---------------------------------------------------------------------------
+    def test_overlapping_is_half_open(self):
+        self.assertEqual(
+            self._titles(
+                datetime(2008, 12, 11, 15, 45), datetime(2008, 12, 11, 16)),
+            ['alpha'])
+
+    #---------------------------------------------------------------------------
+    def test_overlapping_month(self):
+        self.assertEqual(
+            len(self._titles(*utils.month_range(2008, 12))), 7)
+        self.assertEqual(self._titles(*utils.month_range(2008, 11)), [])
+
+    #---------------------------------------------------------------------------
+    def test_overlapping_unbounded(self):
+        location = BookingLocation.objects.get(pk=1)
+        start, end = utils.month_range(2008, 12)
+        self.assertEqual(
+            Occurrence.objects.overlapping(location, None, None).count(),
+            Occurrence.objects.filter(location=location).count())
+        self.assertEqual(
+            Occurrence.objects.overlapping(location, start, None).count(), 7)
+        self.assertEqual(
+            Occurrence.objects.overlapping(location, None, start).count(), 0)
+
+
+#===============================================================================
+class OccurrenceLocationTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def other_location(self):
+        from places.models import Room
+        room = Room.objects.create(
+            building='Other Building', number='B2', slug='b2-other-building')
+        return BookingLocation.objects.create(location=room)
+
+    #---------------------------------------------------------------------------
+    def test_event_moved(self):
+        other = self.other_location()
+        event = Event.objects.get(title='alpha')
+        self.assertTrue(event.occurrence_set.exists())
+        event.location = other
+        event.save()
+        self.assertEqual(
+            set(event.occurrence_set.values_list('location', flat=True)),
+            set([other.pk]))
+
+    #---------------------------------------------------------------------------
+    def test_backfill(self):
+        import importlib
+        from django.apps import apps
+        from django.db import connection
+        migration = importlib.import_module(
+            'swingtime.migrations.0004_occurrence_location')
+
+        other = self.other_location()
+        Occurrence.objects.update(location=other)
+
+        class SchemaEditor(object):
+            pass
+
+        schema_editor = SchemaEditor()
+        schema_editor.connection = connection
+        batch_size = migration.BACKFILL_BATCH_SIZE
+        migration.BACKFILL_BATCH_SIZE = 2
+        try:
+            migration.backfill_occurrence_location(apps, schema_editor)
+        finally:
+            migration.BACKFILL_BATCH_SIZE = batch_size
+        for o in Occurrence.objects.select_related('event'):
+            self.assertEqual(o.location_id, o.event.location_id)
+
+
+#===============================================================================
+class AddOccurrencesTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_add_occurrences_bulk(self):
+        from dateutil import rrule
+
+        location = BookingLocation.objects.get(pk=1)
+        event = Event.objects.create(title='golf', location=location)
+        start = utils.force_aware(datetime(2008, 10, 28, 9))
+        end = utils.force_aware(datetime(2008, 10, 28, 10))
+
+        created = event.add_occurrences(
+            start, end, freq=rrule.WEEKLY, count=3)
+
+        self.assertEqual(len(created), 3)
+        self.assertEqual(event.occurrence_set.count(), 3)
+        # wall clock times are kept across the daylight savings transition
+        for o in event.occurrence_set.all():
+            local_start = utils.force_naive(o.start_time)
+            self.assertEqual(local_start.time(), time(9))
+            self.assertEqual(o.end_time - o.start_time, timedelta(hours=1))
+
+    #---------------------------------------------------------------------------
+    def test_add_single_occurrence(self):
+        location = BookingLocation.objects.get(pk=1)
+        event = Event.objects.create(title='golf', location=location)
+        start = utils.force_aware(datetime(2008, 12, 1, 9))
+        end = utils.force_aware(datetime(2008, 12, 1, 10))
+
+        created = event.add_occurrences(start, end)
+
+        self.assertEqual(len(created), 1)
+        self.assertEqual(event.occurrence_set.get().start_time, start)
+
+
+#===============================================================================
+class RecurrenceHorizonTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        from swingtime.conf import settings as swingtime_settings
+        self.swingtime_settings = swingtime_settings
+        self._horizon = swingtime_settings.RECURRENCE_HORIZON
+        swingtime_settings.RECURRENCE_HORIZON = timedelta(weeks=3)
+
+    #---------------------------------------------------------------------------
+    def tearDown(self):
+        self.swingtime_settings.RECURRENCE_HORIZON = self._horizon
+
+    #---------------------------------------------------------------------------
+    def test_virtual_occurrences(self):
+        from dateutil import rrule
+        from django.utils.timezone import now
+
+        location = BookingLocation.objects.get(pk=1)
+        event = Event.objects.create(title='seminar', location=location)
+        start = now().replace(microsecond=0) + timedelta(days=1)
+
+        created = event.add_occurrences(
+            start, start + timedelta(hours=1), freq=rrule.WEEKLY, count=10)
+
+        self.assertEqual(len(created), 3)
+        self.assertEqual(event.occurrence_set.count(), 3)
+        self.assertTrue(event.recurrence)
+
+        window_end = start + timedelta(weeks=20)
+        virtual = Occurrence.objects.virtual_occurrences(
+            location, start, window_end)
+        self.assertEqual(len(virtual), 7)
+        self.assertTrue(all(o.pk is None for o in virtual))
+
+        # rolling the horizon forward stores the next instances
+        event.materialize(start + timedelta(weeks=5))
+        self.assertEqual(event.occurrence_set.count(), 5)
+        self.assertEqual(
+            len(
+                Occurrence.objects.virtual_occurrences(
+                    location, start, window_end)), 5)
+
+    #---------------------------------------------------------------------------
+    def _recurrence(self):
+        from dateutil import rrule
+        from django.utils.timezone import now
+
+        location = BookingLocation.objects.get(pk=1)
+        event = Event.objects.create(title='seminar', location=location)
+        start = now().replace(microsecond=0) + timedelta(days=1)
+        event.add_occurrences(
+            start, start + timedelta(hours=1), freq=rrule.WEEKLY, count=10)
+        return event, start
+
+    #---------------------------------------------------------------------------
+    def test_upcoming_occurrences(self):
+        event, start = self._recurrence()
+        upcoming = event.upcoming_occurrences()
+        self.assertEqual(
+            [o.start_time for o in upcoming],
+            [start + timedelta(weeks=i) for i in range(10)])
+        self.assertEqual(len([o for o in upcoming if o.pk is None]), 7)
+        self.assertEqual(event.next_occurrence(), upcoming[0])
+
+        # with the stored instances gone, the next one is virtual
+        event.occurrence_set.all().delete()
+        self.assertEqual(event.next_occurrence().start_time,
+                         start + timedelta(weeks=3))
+        self.assertIsNone(event.next_occurrence().pk)
+
+    #---------------------------------------------------------------------------
+    def test_cancel(self):
+        event, start = self._recurrence()
+        location = event.location
+        end = start + timedelta(weeks=20)
+
+        occurrence = event.get_virtual_occurrence(start + timedelta(weeks=5))
+        self.assertEqual(occurrence.start_time, start + timedelta(weeks=5))
+        occurrence.cancel()
+        self.assertTrue(occurrence.cancelled)
+        self.assertIsNone(
+            event.get_virtual_occurrence(start + timedelta(weeks=5)))
+        self.assertEqual(
+            len(Occurrence.objects.virtual_occurrences(location, start, end)),
+            6)
+        self.assertEqual(
+            Occurrence.objects.overlapping(location, start, end).filter(
+                event=event).count(), 3)
+        self.assertEqual(len(event.upcoming_occurrences()), 9)
+
+        # an edited instance is stored; cancelling it keeps it cancelled
+        occurrence = event.get_virtual_occurrence(start + timedelta(weeks=6))
+        occurrence.start_time += timedelta(hours=2)
+        occurrence.end_time += timedelta(hours=2)
+        occurrence.save()
+        self.assertEqual(
+            len(Occurrence.objects.virtual_occurrences(location, start, end)),
+            5)
+        self.assertEqual(
+            Occurrence.objects.overlapping(location, start, end).filter(
+                event=event).count(), 4)
+        occurrence.cancel()
+        self.assertEqual(
+            len(Occurrence.objects.virtual_occurrences(location, start, end)),
+            5)
+        self.assertEqual(
+            Occurrence.objects.overlapping(location, start, end).filter(
+                event=event).count(), 3)
+
+        # a materialized instance is deleted
+        occurrence = event.occurrence_set.order_by('start_time').first()
+        occurrence.cancel()
+        self.assertFalse(Occurrence.objects.filter(pk=occurrence.pk).exists())
+        self.assertEqual(len(event.upcoming_occurrences()), 7)
+
+    #---------------------------------------------------------------------------
+    def test_virtual_views(self):
+        from django.http import Http404
+        from django.test import RequestFactory
+        from django.urls import reverse
+        from django.utils.timezone import localtime
+        from swingtime import views
+
+        event, start = self._recurrence()
+        user = User.objects.create_superuser('admin', 'admin@example.com',
+                                             'pw')
+        factory = RequestFactory()
+        slug = event.location.slug
+
+        def request(method, path='/', data=None):
+            request = getattr(factory, method)(path, data or {})
+            request.user = user
+            return request
+
+        def split(name, dt):
+            dt = localtime(dt)
+            return {
+                name + '_0_year': dt.year,
+                name + '_0_month': dt.month,
+                name + '_0_day': dt.day,
+                name + '_1': dt.strftime('%H:%M:%S'),
+            }
+
+        occurrence = event.get_virtual_occurrence(start + timedelta(weeks=4))
+        stamp = utils.occurrence_stamp(occurrence.original_start_time)
+        self.assertEqual(
+            occurrence.get_absolute_url(),
+            reverse('swingtime-virtual-occurrence',
+                    args=[slug, event.pk, stamp]))
+        response = views.occurrence_view(
+            request('get'), slug, str(event.pk), start=stamp)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(occurrence.get_delete_url().encode('utf-8'),
+                      response.content)
+
+        # updating the instance stores it; its URL then redirects there
+        new_start = occurrence.start_time + timedelta(hours=2)
+        data = split('start_time', new_start)
+        data.update(split('end_time', new_start + timedelta(hours=1)))
+        response = views.occurrence_view(
+            request('post', data=data), slug, str(event.pk), start=stamp)
+        self.assertEqual(response.status_code, 302)
+        stored = event.occurrence_set.get(
+            original_start_time=occurrence.original_start_time)
+        self.assertEqual(stored.start_time, new_start)
+        self.assertEqual(response['Location'], stored.get_absolute_url())
+        response = views.occurrence_view(
+            request('get'), slug, str(event.pk), start=stamp)
+        self.assertEqual(response['Location'], stored.get_absolute_url())
+
+        # deleting another instance cancels it
+        occurrence = event.get_virtual_occurrence(start + timedelta(weeks=5))
+        stamp = utils.occurrence_stamp(occurrence.original_start_time)
+        response = views.occurrence_delete(
+            request('post', data={'_delete': 'Delete'}), slug,
+            str(event.pk), start=stamp)
+        self.assertEqual(response['Location'], event.get_absolute_url())
+        self.assertTrue(
+            event.occurrence_set.get(
+                original_start_time=occurrence.original_start_time).cancelled)
+        self.assertRaises(Http404, views.occurrence_view, request('get'), slug,
+                          str(event.pk), start=stamp)
+        self.assertRaises(Http404, views.occurrence_view, request('get'), slug,
+                          str(event.pk), start='20000101T000000Z')
+
+
+#===============================================================================
+class VEventIndexTest(TestCase):
+
+    #---------------------------------------------------------------------------
+    def _vevent(self, start, end):
+        import vobject
+        ev = vobject.iCalendar().add('vevent')
+        ev.add('dtstart').value = utils.force_aware(start)
+        ev.add('dtend').value = utils.force_aware(end)
+        ev.add('summary').value = start.isoformat()
+        return ev
+
+    #---------------------------------------------------------------------------
+    def test_index_matches_linear_scan(self):
+        from swingtime import libvevent
+
+        vevents = [
+            self._vevent(
+                datetime(2008, 12, 1) + timedelta(hours=7 * i),
+                datetime(2008, 12, 1) + timedelta(hours=7 * i + i % 30))
+            for i in range(200)
+        ]
+        index = libvevent.VEventIndex(reversed(vevents))
+        self.assertEqual(len(index), len(vevents))
+
+        for day in range(1, 32):
+            dt = utils.force_aware(datetime(2008, 12, day))
+            self.assertEqual(
+                [ev.summary.value for ev in libvevent.filter_list_by_day(
+                    index, dt)],
+                [ev.summary.value for ev in libvevent.filter_list_by_day(
+                    vevents, dt)])
+
+        dt = utils.force_aware(datetime(2009, 1, 1))
+        self.assertEqual(
+            len(list(libvevent.filter_list_by_month(index, dt))),
+            len(list(libvevent.filter_list_by_month(vevents, dt))))
+
+
+
+#===============================================================================
+class LocationVersionTest(TransactionTestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_version(self):
+        location = BookingLocation.objects.get(pk=1)
+        version = location.version
+        key = location.cache_key('test', 1)
+        self.assertEqual(location.version, version)
+        self.assertEqual(location.cache_key('test', 1), key)
+        self.assertNotEqual(location.cache_key('test', 2), key)
+
+        location.invalidate_calendar_events()
+        self.assertNotEqual(location.version, version)
+        self.assertNotEqual(location.cache_key('test', 1), key)
+
+    #---------------------------------------------------------------------------
+    def test_location_saved(self):
+        location = BookingLocation.objects.get(pk=1)
+        version = location.version
+        location.location.save()
+        self.assertNotEqual(location.version, version)
+
+    #---------------------------------------------------------------------------
+    def test_calendar_events_state(self):
+        from swingtime import libvevent
+        location = BookingLocation.objects.get(pk=1)
+        state = location.calendar_events_state()
+        location.invalidate_calendar_events()
+        location.scheduled_events  # rebuilds the cached vevent list
+        self.assertEqual(location.calendar_events_state(), state)
+
+        occurrences = list(Occurrence.objects.filter(location=location)[:2])
+        vevents = [libvevent.from_occurrence(o) for o in occurrences]
+        self.assertEqual(
+            libvevent.content_digest(vevents),
+            libvevent.content_digest(
+                [libvevent.from_occurrence(o) for o in occurrences]))
+        self.assertNotEqual(
+            libvevent.content_digest(vevents),
+            libvevent.content_digest(vevents[:1]))
+
+
+#===============================================================================
+class GetOrComputeTest(TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_stale_value(self):
+        import time
+        from swingtime import cache
+        key = cache.make_key('test', 'stale')
+        self.assertEqual(cache.get_or_compute(key, lambda: 1, 60), 1)
+        self.assertEqual(cache.get_or_compute(key, lambda: 2, 60), 1)
+
+        # expired: served as is while another process holds the lock...
+        cache.get_cache().set(key, cache._Entry(time.time() - 1, 1), 60)
+        cache.get_cache().add(key + ':lock', True, 60)
+        self.assertEqual(cache.get_or_compute(key, lambda: 2, 60), 1)
+
+        # ... and recomputed otherwise
+        cache.get_cache().delete(key + ':lock')
+        self.assertEqual(cache.get_or_compute(key, lambda: 2, 60), 2)
+        self.assertEqual(cache.get_or_compute(key, lambda: 3, 60), 2)
+        cache.get_cache().delete(key)
+
+
+#===============================================================================
+class FragmentCacheTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_month_grid_fragment(self):
+        from swingtime import cache, calendar_data, views
+        location = BookingLocation.objects.get(pk=1)
+        key = views.fragment_key(location, 'month-grid', 2008, 12, 0, 1)
+        self.assertNotEqual(
+            key, views.fragment_key(location, 'month-grid', 2008, 12, 0, 0))
+
+        def get_context():
+            context = calendar_data.month_data(location, 2008, 12)
+            context['can_edit'] = True
+            return context
+
+        html = views.render_fragment(
+            key, 'swingtime/includes/month_grid.html', get_context)
+        self.assertIn('alpha', html)
+        self.assertEqual(
+            views.render_fragment(key, 'swingtime/includes/month_grid.html',
+                                  None), html)
+
+        cache.bump_location_version(location.pk)
+        self.assertNotEqual(
+            views.fragment_key(location, 'month-grid', 2008, 12, 0, 1), key)
+
+
+#===============================================================================
+class MonthDataTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_month_data(self):
+        from swingtime import calendar_data
+        location = BookingLocation.objects.get(pk=1)
+        data = calendar_data.month_data(location, 2008, 12)
+        titles = sorted(o.title for row in data['calendar']
+                        for day, items in row for o in items)
+        self.assertEqual(len(titles), 7)
+        self.assertEqual(data['this_month'],
+                         utils.force_aware(datetime(2008, 12, 1)))
+
+        # the day buckets are now cached under the location's version
+        with self.assertNumQueries(0):
+            by_day = calendar_data.month_days(location, 2008, 12)
+        self.assertEqual(
+            sorted(o.title for items in by_day.values() for o in items),
+            titles)
+
+        # a new booking changes the version (normally when the transaction
+        # commits, which never happens in a TestCase)
+        Event.objects.get(title='alpha').add_occurrences(
+            utils.force_aware(datetime(2008, 12, 20, 10)),
+            utils.force_aware(datetime(2008, 12, 20, 11)))
+        from swingtime import cache
+        cache.bump_location_version(location.pk)
+        by_day = calendar_data.month_days(location, 2008, 12)
+        self.assertEqual(len(by_day[20]), 1)
+
+    #---------------------------------------------------------------------------
+    def test_scheduled_events_changed(self):
+        # the month data picks up a change of the external schedule once the
+        # scheduled events are checked again, without any invalidation.
+        from swingtime import calendar_data, libvevent
+        from swingtime.conf import settings as swingtime_settings
+        location = BookingLocation.objects.get(pk=1)
+        event = Event.objects.get(title='alpha')
+        vevents = []
+        calendar_events = BookingLocation.calendar_events
+        timeout = swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT
+        BookingLocation.calendar_events = lambda self, *args: list(vevents)
+        try:
+            location.invalidate_calendar_events()
+            by_day = calendar_data.month_days(location, 2008, 12)
+            self.assertEqual(len(by_day.get(20, [])), 0)
+
+            vevents.append(libvevent.from_occurrence(Occurrence(
+                event=event, location=location,
+                start_time=utils.force_aware(datetime(2008, 12, 20, 10)),
+                end_time=utils.force_aware(datetime(2008, 12, 20, 11)))))
+            by_day = calendar_data.month_days(location, 2008, 12)
+            self.assertEqual(len(by_day.get(20, [])), 0)
+
+            swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT = 0
+            by_day = calendar_data.month_days(location, 2008, 12)
+            self.assertEqual(len(by_day.get(20, [])), 1)
+        finally:
+            BookingLocation.calendar_events = calendar_events
+            swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT = timeout
+            location.invalidate_calendar_events()
+
+    #---------------------------------------------------------------------------
+    def test_year_summary(self):
+        from swingtime import calendar_data
+        location = BookingLocation.objects.get(pk=1)
+        summary = calendar_data.year_summary(location, 2008)
+        self.assertEqual(len(summary), 12)
+        self.assertEqual([m['count'] for m in summary], [0] * 11 + [7])
+        december = summary[11]
+        self.assertEqual(december['month'],
+                         utils.force_aware(datetime(2008, 12, 1)))
+        self.assertTrue(december['first_start'] <= december['last_start'])
+        self.assertTrue(december['first_title'])
+
+
+#===============================================================================
+class MergeByStartTest(TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_merge_by_start(self):
+        from swingtime import libvevent
+        dt = utils.force_aware(datetime(2008, 12, 1))
+
+        def records(title, *hours):
+            return [
+                libvevent.EventRecord(dt + timedelta(hours=h),
+                                      dt + timedelta(hours=h + 1), title,
+                                      'Room', None) for h in hours
+            ]
+
+        merged = utils.merge_by_start(
+            iter(records('a', 1, 5, 30)), records('b', 0, 5), [],
+            records('c', -3, 50))
+        self.assertEqual([(r.title, (r.start_time - dt).total_seconds() // 3600)
+                          for r in merged],
+                         [('c', -3), ('b', 0), ('a', 1), ('a', 5), ('b', 5),
+                          ('a', 30), ('c', 50)])
+
+    #---------------------------------------------------------------------------
+    def test_group_by_day(self):
+        from swingtime import libvevent
+        dt = utils.force_aware(datetime(2008, 12, 1))
+        items = [
+            libvevent.EventRecord(dt + timedelta(hours=h),
+                                  dt + timedelta(hours=h + 1), '%d' % h,
+                                  'Room', None) for h in (-3, 1, 23, 24, 50)
+        ]
+        by_day = utils.group_by_day(items, dt)
+        self.assertEqual(
+            dict((day, [r.title for r in group])
+                 for day, group in by_day.items()),
+            {1: ['-3', '1', '23'], 2: ['24'], 3: ['50']})
+
+
+#===============================================================================
+class CSSClassCyclerTest(TransactionTestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_css_class_cycler(self):
+        location = BookingLocation.objects.get(pk=1)
+        utils.invalidate_css_class_names()
+        with self.assertNumQueries(1):
+            cycles = [utils.css_class_cycler() for i in range(5)]
+
+        name = '{}'.format(location)
+        classes = [cycles[0][name]() for i in range(3)]
+        self.assertEqual(classes, [
+            'evt-%s-even' % location.slug,
+            'evt-%s-odd' % location.slug,
+            'evt-%s-even' % location.slug,
+        ])
+        self.assertEqual(cycles[1][name](), 'evt-%s-even' % location.slug)
+        self.assertEqual(cycles[0]['elsewhere'](), 'evt-even')
+
+    #---------------------------------------------------------------------------
+    def test_once_per_table(self):
+        location = BookingLocation.objects.get(pk=1)
+        css_class_names, calls = utils.css_class_names, []
+
+        def counted():
+            calls.append(1)
+            return css_class_names()
+
+        utils.css_class_names = counted
+        try:
+            table = utils.create_timeslot_table(
+                location, dt=utils.force_aware(datetime(2008, 12, 11)))
+        finally:
+            utils.css_class_names = css_class_names
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(
+            any(cell.event_class for tm, cells in table for cell in cells
+                if cell))
+
+    #---------------------------------------------------------------------------
+    def test_invalidated_on_save(self):
+        location = BookingLocation.objects.get(pk=1)
+        utils.css_class_cycler()
+        location.save()
+        with self.assertNumQueries(1):
+            utils.css_class_cycler()
+
+
+#===============================================================================
+class TimeslotTemplateTest(TestCase):
+
+    #---------------------------------------------------------------------------
+    def test_template(self):
+        from swingtime import timeslots
+        template = timeslots.get_template(
+            date(2008, 12, 11), time(8), timedelta(hours=1),
+            timedelta(minutes=30), None, '%H:%M')
+        self.assertEqual(template.rowkeys, (datetime(2008, 12, 11, 8),
+                                            datetime(2008, 12, 11, 8, 30),
+                                            datetime(2008, 12, 11, 9)))
+        self.assertEqual(template.offsets, (28800, 30600, 32400))
+        self.assertEqual(template.labels, ('08:00', '08:30', '09:00'))
+        self.assertIs(
+            timeslots.get_template(date(2008, 12, 11), time(8),
+                                   timedelta(hours=1), timedelta(minutes=30),
+                                   None, '%H:%M'), template)
+
+    #---------------------------------------------------------------------------
+    def test_eviction(self):
+        from swingtime import timeslots
+        timeslots.clear()
+        first = timeslots.get_template(date(2008, 1, 1))
+        for day in range(1, timeslots.CACHE_SIZE + 1):
+            timeslots.get_template(date(2008, 1, 1) + timedelta(days=day))
+        self.assertIsNot(timeslots.get_template(date(2008, 1, 1)), first)
+
+
+#===============================================================================
+class LocationPermissionsTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_memoized(self):
+        from django.contrib.auth.models import Permission
+        from swingtime.views import check_permission, get_location_list
+        location = BookingLocation.objects.get(pk=1)
+        user = User.objects.create_user('viewer', 'viewer@example.com', 'pw')
+        user.user_permissions.add(
+            Permission.objects.get(
+                content_type__app_label='swingtime',
+                codename='book_can_view'))
+        user = User.objects.get(pk=user.pk)
+
+        self.assertTrue(
+            check_permission(user, 'swingtime.book_can_view', location))
+        locations = get_location_list(user)
+        self.assertEqual(list(locations), [location])
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                check_permission(user, 'swingtime.book_can_view', location))
+            self.assertIs(get_location_list(user), locations)
+            self.assertEqual(list(get_location_list(user)), [location])
+
+        # a fresh user object (as for the next request) sees the changes
+        user.user_permissions.clear()
+        user = User.objects.get(pk=user.pk)
+        self.assertFalse(
+            check_permission(user, 'swingtime.book_can_view', location))
+
+
+#===============================================================================
+class ResolveSlugTest(TransactionTestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_resolve_slug(self):
+        slug = 'a113-building-name'
+        location = BookingLocation.objects.resolve_slug(slug)
+        self.assertEqual(location.pk, 1)
+        with self.assertNumQueries(0):
+            again = BookingLocation.objects.resolve_slug(slug)
+            self.assertEqual(again.slug, slug)
+            self.assertEqual('{}'.format(again), '{}'.format(location))
+        self.assertIsNot(again, location)
+
+        # saving the room discards the resolved locations
+        room = location.location
+        room.active = False
+        room.save()
+        self.assertRaises(BookingLocation.DoesNotExist,
+                          BookingLocation.objects.resolve_slug, slug)
+
+
+#===============================================================================
+class EventListingTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def test_occurrence_stats(self):
+        now = utils.force_aware(datetime(2008, 12, 11))
+        for event in Event.objects.with_occurrence_stats(now):
+            occurrences = event.occurrence_set.order_by('start_time')
+            self.assertEqual(event.occurrence_count, occurrences.count())
+            upcoming = occurrences.filter(start_time__gte=now).first()
+            self.assertEqual(event.next_start, upcoming and upcoming.start_time)
+
+    #---------------------------------------------------------------------------
+    def test_virtual_occurrence_stats(self):
+        from dateutil import rrule
+        from django.utils.timezone import now
+        from swingtime.conf import settings as swingtime_settings
+        from swingtime.models import add_virtual_occurrence_stats
+
+        horizon = swingtime_settings.RECURRENCE_HORIZON
+        swingtime_settings.RECURRENCE_HORIZON = timedelta(weeks=3)
+        try:
+            location = BookingLocation.objects.get(pk=1)
+            event = Event.objects.create(title='seminar', location=location)
+            start = now().replace(microsecond=0) + timedelta(days=1)
+            event.add_occurrences(
+                start, start + timedelta(hours=1), freq=rrule.WEEKLY,
+                count=10)
+        finally:
+            swingtime_settings.RECURRENCE_HORIZON = horizon
+        event.get_virtual_occurrence(start + timedelta(weeks=5)).cancel()
+        # with the materialized instances gone, the next one is virtual
+        event.occurrence_set.filter(
+            start_time__lt=start + timedelta(weeks=3)).delete()
+
+        at = now()
+        events = list(Event.objects.with_occurrence_stats(at))
+        with self.assertNumQueries(1):
+            add_virtual_occurrence_stats(events, at)
+        for e in events:
+            if e.pk == event.pk:
+                self.assertEqual(e.occurrence_count, 6)
+                self.assertEqual(e.next_start, start + timedelta(weeks=3))
+            else:
+                self.assertEqual(e.occurrence_count,
+                                 e.occurrence_set.count())
+
+    #---------------------------------------------------------------------------
+    def test_keyset_pages(self):
+        from swingtime.views import decode_event_cursor, encode_event_cursor
+        events = Event.objects.order_by('title', 'pk')
+        expected = list(events)
+        self.assertTrue(len(expected) > 1)
+
+        pages, cursor = [], None
+        while True:
+            page = events.after(*cursor) if cursor else events
+            page = list(page[:2])
+            pages.extend(page)
+            if len(page) < 2:
+                break
+            cursor = decode_event_cursor(encode_event_cursor(page[-1]))
+        self.assertEqual(pages, expected)
+        self.assertRaises(ValueError, decode_event_cursor, 'not a cursor')
+
+
+#===============================================================================
+class WebcalTest(TestCase):
+
+    fixtures = ['swingtime_test']
+
+    #---------------------------------------------------------------------------
+    def setUp(self):
+        from django.test import RequestFactory
+        self.factory = RequestFactory()
+        self.location = BookingLocation.objects.get(pk=1)
+
+    #---------------------------------------------------------------------------
+    def webcal(self, params=None, **headers):
+        from swingtime.views import webcal
+        return webcal(self.factory.get('/', params or {}, **headers),
+                      'a113-building-name')
+
+    #---------------------------------------------------------------------------
+    def test_conditional_get(self):
+        from swingtime import cache, libvevent
+        from swingtime.conf import settings as swingtime_settings
+        vevents = []
+        calendar_events = BookingLocation.calendar_events
+        timeout = swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT
+        BookingLocation.calendar_events = lambda self, *args: list(vevents)
+        try:
+            self.location.invalidate_calendar_events()
+            response = self.webcal()
+            self.assertEqual(response.status_code, 200)
+            etag, last_modified = response['ETag'], response['Last-Modified']
+            self.assertEqual(
+                self.webcal(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(
+                self.webcal(HTTP_IF_MODIFIED_SINCE=last_modified).status_code,
+                304)
+
+            # a booking change (the version is normally bumped when the
+            # transaction commits, which never happens in a TestCase)
+            Event.objects.get(title='alpha').add_occurrences(
+                utils.force_aware(datetime(2008, 12, 20, 10)),
+                utils.force_aware(datetime(2008, 12, 20, 11)))
+            cache.bump_location_version(self.location.pk)
+            response = self.webcal(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertEqual(
+                self.webcal(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            # a change of the external schedule, once it is checked again
+            vevents.append(libvevent.from_occurrence(Occurrence(
+                event=Event.objects.get(title='bravo'),
+                location=self.location,
+                start_time=utils.force_aware(datetime(2008, 12, 21, 10)),
+                end_time=utils.force_aware(datetime(2008, 12, 21, 11)))))
+            swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT = 0
+            response = self.webcal(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertIn(b'20081221T100000Z',
+                          b''.join(response.streaming_content))
+        finally:
+            BookingLocation.calendar_events = calendar_events
+            swingtime_settings.SCHEDULED_EVENTS_CACHE_TIMEOUT = timeout
+            self.location.invalidate_calendar_events()
+
+    #---------------------------------------------------------------------------
+    def test_stream(self):
+        import vobject
+        from swingtime import libvevent
+        from swingtime.views import iter_webcal
+        occurrences = list(Occurrence.objects.filter(
+            location=self.location).order_by('start_time'))
+        Note.objects.create(content_object=occurrences[0], note='on occurrence')
+        Note.objects.create(content_object=occurrences[0].event,
+                            note='on event')
+        vevents = [libvevent.from_occurrence(Occurrence(
+            event=occurrences[1].event, location=self.location,
+            start_time=utils.force_aware(datetime(2008, 12, 21, 10)),
+            end_time=utils.force_aware(datetime(2008, 12, 21, 11))))]
+
+        cal = vobject.iCalendar()
+        cal.add('method').value = 'PUBLISH'
+        cal.add('x-wr-calname').value = '{}'.format(self.location)
+        cal.add('x-published-ttl').value = 'PT15M'
+        for o in Occurrence.objects.filter(
+                location=self.location).order_by('start_time'):
+            cal.add(libvevent.from_occurrence(o))
+        for vev in vevents:
+            cal.add(vev)
+
+        def lines(ical):
+            return [
+                line for line in ical.splitlines()
+                if not line.startswith(('UID:', 'DTSTAMP:'))
+            ]
+
+        streamed = ''.join(iter_webcal(self.location, occurrences, vevents))
+        self.assertEqual(lines(streamed), lines(cal.serialize()))
+        unfolded = streamed.replace('\r\n ', '')
+        self.assertIn('on event\\non occurrence', unfolded)
+
+    #---------------------------------------------------------------------------
+    def test_window(self):
+        from django.utils.timezone import localdate
+        from swingtime.conf import settings as swingtime_settings
+        from swingtime.views import webcal_window
+        today = localdate()
+
+        def window(params):
+            return webcal_window(self.factory.get('/', params))
+
+        def day(d, days=0):
+            return utils.force_aware(
+                datetime.combine(d + timedelta(days=days), time(0)))
+
+        default = swingtime_settings.WEBCAL_DEFAULT_WINDOW
+        swingtime_settings.WEBCAL_DEFAULT_WINDOW = None
+        try:
+            self.assertEqual(window({}), (None, None))
+            self.assertEqual(window({'past_days': '3', 'future_days': '10'}),
+                             (day(today, -3), day(today, 10)))
+            self.assertEqual(window({'start': '2008-12-01'}),
+                             (day(date(2008, 12, 1)), None))
+            self.assertEqual(window({'start': '2008-12-01',
+                                     'end': '2008-12-31'}),
+                             (day(date(2008, 12, 1)), day(date(2009, 1, 1))))
+
+            swingtime_settings.WEBCAL_DEFAULT_WINDOW = (timedelta(days=7),
+                                                        timedelta(days=30))
+            self.assertEqual(window({}), (day(today, -7), day(today, 30)))
+            self.assertEqual(window({'past_days': '1'}),
+                             (day(today, -1), day(today, 30)))
+            # an empty value removes the bound
+            self.assertEqual(window({'start': ''}), (None, day(today, 30)))
+            self.assertEqual(window({'past_days': '', 'end': ''}),
+                             (None, None))
+
+            for params in ({'start': 'nonsense'}, {'end': '2008-13-45'},
+                           {'past_days': 'x'}, {'future_days': '1.5'}):
+                self.assertRaises(ValueError, window, params)
+        finally:
+            swingtime_settings.WEBCAL_DEFAULT_WINDOW = default
+
+    #---------------------------------------------------------------------------
+    def test_window_view(self):
+        self.assertEqual(self.webcal({'start': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.webcal({'past_days': 'x'}).status_code, 400)
+
+        Event.objects.get(title='alpha').add_occurrences(
+            utils.force_aware(datetime(2008, 12, 20, 10)),
+            utils.force_aware(datetime(2008, 12, 20, 11)))
+        start = utils.force_aware(datetime(2008, 12, 11))
+        end = start + timedelta(days=1)
+        expected = (
+            Occurrence.objects.overlapping(self.location, start, end).count() +
+            len(Occurrence.objects.virtual_occurrences(
+                self.location, start, end)) +
+            len(self.location.scheduled_events.overlapping(start, end)))
+        response = self.webcal({'start': '2008-12-11', 'end': '2008-12-11'})
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertTrue(expected > 0)
+        self.assertEqual(content.count(b'BEGIN:VEVENT'), expected)
+        # unbounded (with the default WEBCAL_DEFAULT_WINDOW)
+        content = b''.join(self.webcal().streaming_content)
+        self.assertEqual(
+            content.count(b'BEGIN:VEVENT'),
+            Occurrence.objects.filter(location=self.location).count() +
+            len(self.location.scheduled_events))
+
+
 #-------------------------------------------------------------------------------
 def doc_tests():
     '''
@@ -0,0 +1,103 @@
+'''
+Timeslot templates: the row times of the timeslot grids and the options of
+the time selectors in forms, computed once per (start time, end delta,
+interval, timezone, date) and kept in a small LRU cache.
+
+'''
+#######################
+from __future__ import print_function, unicode_literals
+
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import date, datetime, time
+
+from django.utils.timezone import make_aware
+
+from .conf import settings as swingtime_settings
+
+#######################
+
+# the number of timeslot templates kept in memory.
+CACHE_SIZE = 64
+
+_templates = OrderedDict()
+_lock = threading.Lock()
+
+#===============================================================================
+
+
+class TimeslotTemplate(
+        namedtuple('TimeslotTemplate', 'rowkeys offsets labels')):
+    '''
+    The timeslots of a day: ``rowkeys`` is a tuple of the datetimes of the
+    timeslots, ``offsets`` the number of seconds from the start of the day to
+    each, and ``labels`` each formatted with the format of the template.
+
+    '''
+    __slots__ = ()
+
+
+#-------------------------------------------------------------------------------
+
+
+def _build(day, start_time, end_delta, interval, tzinfo, fmt):
+    dt = datetime.combine(day, start_time)
+    if tzinfo is not None:
+        dt = make_aware(dt, tzinfo)
+    dtend = dt + end_delta
+    offset = (datetime.combine(day, start_time) -
+              datetime.combine(day, time(0))).total_seconds()
+    step = interval.total_seconds()
+
+    rowkeys, offsets, labels = [], [], []
+    while dt <= dtend:
+        rowkeys.append(dt)
+        offsets.append(int(offset))
+        labels.append(dt.strftime(fmt))
+        dt += interval
+        offset += step
+
+    return TimeslotTemplate(tuple(rowkeys), tuple(offsets), tuple(labels))
+
+
+#-------------------------------------------------------------------------------
+
+
+def get_template(day=None,
+                 start_time=swingtime_settings.TIMESLOT_START_TIME,
+                 end_delta=swingtime_settings.TIMESLOT_END_TIME_DURATION,
+                 interval=swingtime_settings.TIMESLOT_INTERVAL,
+                 tzinfo=None,
+                 fmt=swingtime_settings.TIMESLOT_TIME_FORMAT):
+    '''
+    Return the ``TimeslotTemplate`` for the given ``day`` (default: today),
+    from ``start_time`` to ``start_time + end_delta`` by ``interval``. The
+    datetimes are naive if ``tzinfo`` is ``None``, aware in ``tzinfo``
+    otherwise.
+
+    '''
+    key = (day or date.today(), start_time, end_delta, interval, tzinfo, fmt)
+    with _lock:
+        template = _templates.pop(key, None)
+        if template is not None:
+            _templates[key] = template
+            return template
+
+    template = _build(*key)
+    with _lock:
+        _templates[key] = template
+        while len(_templates) > CACHE_SIZE:
+            _templates.popitem(last=False)
+    return template
+
+
+#-------------------------------------------------------------------------------
+
+
+def clear():
+    '''
+    Discard all the timeslot templates.
+
+    '''
+    with _lock:
+        _templates.clear()
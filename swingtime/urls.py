@@ -37,6 +37,9 @@ urlpatterns = [
     url(r'^(?P<calendar_slug>[\w_-]+)/(?P<year>\d{4})/(?P<month>0?[1-9]|1[012])/(?P<day>[0-3]?\d)/$',
         views.day_view,
         name='swingtime-daily-view'),
+    url(r'^(?P<calendar_slug>[\w_-]+)/(?P<year>\d{4})/(?P<month>0?[1-9]|1[012])/(?P<day>[0-3]?\d)/week/$',
+        views.week_view,
+        name='swingtime-weekly-view'),
     url(r'^(?P<calendar_slug>[\w_-]+)/events/$',
         views.event_listing,
         name='swingtime-events'),
@@ -56,6 +59,16 @@ urlpatterns = [
         views.occurrence_delete,
         name='swingtime-occurrence-delete',
     ),
+    url(
+        r'^(?P<calendar_slug>[\w_-]+)/events/(?P<event_pk>\d+)/at/(?P<start>\d{8}T\d{6}Z)/$',
+        views.occurrence_view,
+        name='swingtime-virtual-occurrence',
+    ),
+    url(
+        r'^(?P<calendar_slug>[\w_-]+)/events/(?P<event_pk>\d+)/at/(?P<start>\d{8}T\d{6}Z)/delete/$',
+        views.occurrence_delete,
+        name='swingtime-virtual-occurrence-delete',
+    ),
     ## TODO: update these to calendar_slug
     url(
         r'^webcal/(?P<room_slug>[\w_-]+)$',
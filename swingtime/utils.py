@@ -5,7 +5,12 @@ Common features and functions for swingtime
 #######################
 from __future__ import print_function, unicode_literals
 
+import bisect
+import calendar
+import functools
+import heapq
 import itertools
+import uuid
 #######################
 from collections import defaultdict
 from datetime import date, datetime, time, timedelta
@@ -13,13 +18,14 @@ from datetime import date, datetime, time, timedelta
 from dateutil import rrule
 from django.conf import global_settings, settings
 from django.db.models.query import QuerySet
+from django.urls import reverse
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.safestring import mark_safe
-from django.utils.timezone import (get_current_timezone, is_aware, make_aware,
-                                   make_naive)
+from django.utils.timezone import (get_current_timezone, is_aware, localtime,
+                                   make_aware, make_naive, utc)
 from django.utils.timezone import now as datetime_now
 
-from . import libvevent
+from . import cache, libvevent, timeslots
 from .conf import settings as swingtime_settings
 
 #-------------------------------------------------------------------------------
@@ -27,6 +33,11 @@ from .conf import settings as swingtime_settings
 # Safely get the current USE_TZ setting, falling back to defaults in needed.
 USE_TZ = getattr(settings, 'USE_TZ', getattr(global_settings, 'USE_TZ'))
 
+# the CSS class names of the booking locations, as (cache epoch, names); see
+# ``css_class_names``.
+_css_class_names = (None, None)
+CSS_CLASS_EPOCH_KEY = cache.make_key('css-class-epoch')
+
 #-------------------------------------------------------------------------------
 
 
@@ -65,6 +76,35 @@ def force_naive(dt, timezone=None):
     return make_naive(dt, timezone)
 
 
+#-------------------------------------------------------------------------------
+
+# the format of the start times identifying the instances of stored
+# recurrences in URLs (see ``occurrence_stamp``).
+STAMP_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+def occurrence_stamp(dt):
+    """
+    Format the original start time of an instance of a stored recurrence
+    for its URL, in UTC and to the second.
+    """
+    if not is_aware(dt):
+        dt = make_aware(dt)
+    return dt.astimezone(utc).strftime(STAMP_FORMAT)
+
+
+#-------------------------------------------------------------------------------
+
+
+def parse_occurrence_stamp(stamp):
+    """
+    Return the datetime formatted by ``occurrence_stamp``. Raises
+    ``ValueError`` for a malformed stamp.
+    """
+    dt = datetime.strptime(stamp, STAMP_FORMAT).replace(tzinfo=utc)
+    return dt if USE_TZ else make_naive(dt)
+
+
 #-------------------------------------------------------------------------------
 
 
@@ -117,19 +157,220 @@ def month_boundaries(dt=None):
 
 
 #-------------------------------------------------------------------------------
-def css_class_cycler():
+def month_range(year, month):
+    '''
+    Return a 2-tuple containing the datetime instances for the start of the
+    given month and the start of the following month, suitable for half-open
+    range queries.
+
+    '''
+    if month == 12:
+        end = datetime(year + 1, 1, 1)
+    else:
+        end = datetime(year, month + 1, 1)
+    return (force_aware(datetime(year, month, 1)), force_aware(end))
+
+
+#-------------------------------------------------------------------------------
+def _by_start(items, index):
+    for n, item in enumerate(items):
+        yield item.start_time, index, n, item
+
+
+#-------------------------------------------------------------------------------
+def merge_by_start(*streams):
+    '''
+    Lazily merge the given iterables of occurrences (or records), each already
+    sorted by start time, into a single iterator sorted by start time. Items
+    with the same start time come in the order of their streams.
+
+    '''
+    return (item for start, index, n, item in heapq.merge(
+        *[_by_start(items, i) for i, items in enumerate(streams)]))
+
+
+#-------------------------------------------------------------------------------
+def group_by_day(items, dtstart):
+    '''
+    Group the ``items``, sorted by start time, by the day of the month (in the
+    current timezone) of their start; the items starting before ``dtstart``
+    are grouped on its day. Returns a dictionary of lists keyed by day.
+
+    '''
+    return dict(
+        (dom, list(group)) for dom, group in itertools.groupby(
+            items, lambda o: localtime(max(o.start_time, dtstart)).day))
+
+
+#-------------------------------------------------------------------------------
+def css_class_names():
     '''
-    Return a dictionary keyed by ``EventType`` abbreviations, whose values are an
-    iterable or cycle of CSS class names.
+    Return a dictionary mapping the names of the active booking locations to
+    their (even, odd) CSS class names.
+
+    It is computed with a single query, once per process and cache epoch (see
+    ``invalidate_css_class_names``).
 
     '''
+    global _css_class_names
     from .models import BookingLocation
-    return defaultdict(
-        lambda: itertools.cycle(('evt-even', 'evt-odd')).next,
-        ((o.slug,
-          itertools.cycle(
-              ('evt-%s-even' % o.slug, 'evt-%s-odd' % o.slug)).next)
-         for o in BookingLocation.objects.filter(active=True)))
+    epoch = cache.get_cache().get(CSS_CLASS_EPOCH_KEY)
+    names_epoch, names = _css_class_names
+    if names is None or names_epoch != epoch:
+        names = dict(
+            ("{}".format(o), ('evt-%s-even' % o.slug, 'evt-%s-odd' % o.slug))
+            for o in BookingLocation.objects.filter(
+                active=True).select_related('location'))
+        _css_class_names = (epoch, names)
+    return names
+
+
+#-------------------------------------------------------------------------------
+def invalidate_css_class_names():
+    '''
+    Discard the CSS class names of the booking locations, in this process and
+    (by starting a new cache epoch) in all the processes sharing the cache.
+
+    '''
+    global _css_class_names
+    _css_class_names = (None, None)
+    cache.get_cache().set(CSS_CLASS_EPOCH_KEY, uuid.uuid4().hex, None)
+
+
+#===============================================================================
+class CSSClassCycles(dict):
+    '''
+    A dictionary keyed by booking location names, whose values are callables
+    returning the location's CSS class names in turn; the cyclers are created
+    on first use.
+
+    '''
+
+    #---------------------------------------------------------------------------
+    def __init__(self, names):
+        super(CSSClassCycles, self).__init__()
+        self.names = names
+
+    #---------------------------------------------------------------------------
+    def __missing__(self, key):
+        classes = self.names.get(key, ('evt-even', 'evt-odd'))
+        cycler = self[key] = functools.partial(next, itertools.cycle(classes))
+        return cycler
+
+
+#-------------------------------------------------------------------------------
+def css_class_cycler(names=None):
+    '''
+    Return a dictionary keyed by booking location names, whose values are
+    callables returning progressive CSS class names for the location.
+
+    ``names`` are the CSS class names of the locations, by default
+    ``css_class_names()``.
+
+    '''
+    return CSSClassCycles(css_class_names() if names is None else names)
+
+
+#-------------------------------------------------------------------------------
+def snap_to_grid(rowkeys, time_delta, start_time, end_time):
+    '''
+    Row policy for ``create_timeslot_table``: returns the (first, last) slice
+    of the rows spanned by an item from ``start_time`` to ``end_time``, or
+    ``None`` if the item falls outside the grid.
+
+    The item start is snapped down and its end up to the row boundaries,
+    so that items off the ``time_delta`` intervals are still shown. An item
+    always spans at least one row.
+
+    '''
+    if not rowkeys or start_time >= rowkeys[-1] + time_delta:
+        return None
+    first = max(bisect.bisect_right(rowkeys, start_time) - 1, 0)
+    last = bisect.bisect_left(rowkeys, end_time, first + 1)
+    return first, last
+
+
+#-------------------------------------------------------------------------------
+def match_grid(rowkeys, time_delta, start_time, end_time):
+    '''
+    Row policy for ``create_timeslot_table``: like ``snap_to_grid``, except
+    that an item is only shown if it starts on one of the rows (or before
+    the first).
+
+    '''
+    if not rowkeys:
+        return None
+    start_time = max(start_time, rowkeys[0])
+    first = bisect.bisect_left(rowkeys, start_time)
+    if first == len(rowkeys) or rowkeys[first] != start_time:
+        return None
+    return first, bisect.bisect_left(rowkeys, end_time, first + 1)
+
+
+#===============================================================================
+class OccurrenceURLs(object):
+    '''
+    Build the URLs of the occurrences of a location, reversing each URL
+    pattern only once and formatting the ids into the result.
+
+    An instance is called with an ``Occurrence`` (stored or virtual), or any
+    other item with a ``get_absolute_url`` method, and returns its URL.
+
+    '''
+
+    # placeholder ids and stamp, replaced by the real ones in the reversed URLs
+    SENTINELS = ('1000000001', '1000000002')
+    STAMP_SENTINEL = '10000101T000001Z'
+
+    #---------------------------------------------------------------------------
+    def __init__(self, location):
+        self.location_id = location.pk
+        slug = location.slug
+        event_id, pk = self.SENTINELS
+        self.event_url = self._template('swingtime-event', slug, event_id)
+        self.occurrence_url = self._template('swingtime-occurrence', slug,
+                                             event_id, pk)
+        self.virtual_url = self._template('swingtime-virtual-occurrence',
+                                          slug, event_id, self.STAMP_SENTINEL)
+
+    #---------------------------------------------------------------------------
+    def _template(self, name, slug, *sentinels):
+        url = reverse(name, args=(slug, ) + sentinels)
+        url = url.replace('{', '{{').replace('}', '}}')
+        for i, sentinel in enumerate(sentinels):
+            if url.count(sentinel) != 1:
+                return None
+            url = url.replace(sentinel, '{%d}' % i)
+        return url
+
+    #---------------------------------------------------------------------------
+    def __call__(self, item):
+        if getattr(item, 'location_id', None) != self.location_id:
+            return item.get_absolute_url()
+        return self.for_ids(item.event_id, item.pk,
+                            item.original_start_time) or item.get_absolute_url()
+
+    #---------------------------------------------------------------------------
+    def for_ids(self, event_id, pk=None, start=None):
+        '''
+        Return the URL of the occurrence ``pk`` of the event ``event_id`` at
+        the location, or if ``pk`` is ``None``, of the instance of its stored
+        recurrence starting at ``start``, or of the event if ``start`` is
+        ``None`` too; ``None`` if the URL cannot be built from the reversed
+        pattern.
+
+        '''
+        if pk is None and start is not None:
+            if self.virtual_url is None:
+                return None
+            return self.virtual_url.format(event_id, occurrence_stamp(start))
+        if pk is None:
+            if self.event_url is None:
+                return None
+            return self.event_url.format(event_id)
+        if self.occurrence_url is None:
+            return None
+        return self.occurrence_url.format(event_id, pk)
 
 
 #===============================================================================
@@ -144,11 +385,12 @@ class BaseOccurrenceProxy(object):
     '''
 
     #---------------------------------------------------------------------------
-    def __init__(self, occurrence, col, show_event_links):
+    def __init__(self, occurrence, col, show_event_links, url=None):
         self.column = col
         self._occurrence = occurrence
         self.event_class = ''
         self.show_event_links = show_event_links
+        self.url = url
 
     #---------------------------------------------------------------------------
     def __getattr__(self, name):
@@ -163,23 +405,62 @@ class BaseOccurrenceProxy(object):
 
 
 @python_2_unicode_compatible
-class DefaultOccurrenceProxy(BaseOccurrenceProxy):
+class DefaultOccurrenceProxy(object):
+    '''
+    A lightweight wrapper for showing an ``Occurrence`` (or an ``EventRecord``)
+    in a timeslot grid: it renders as a link to the occurrence in its first
+    cell, and as a continuation marker in the following ones.
+
+    The ``url`` is the precomputed URL of the occurrence (see
+    ``OccurrenceURLs``), or ``None`` to not link it.
+
+    '''
+    __slots__ = ('_occurrence', 'column', 'event_class', 'show_event_links',
+                 'url', 'title', '_rendered')
 
     #---------------------------------------------------------------------------
-    def __init__(self, *args, **kws):
-        super(DefaultOccurrenceProxy, self).__init__(*args, **kws)
-        if self.get_absolute_url is not None and self.show_event_links:
-            link = '<a href="%s">%s</a>' % (self.get_absolute_url(),
-                                            self.title)
-        else:
-            link = self.title
+    def __init__(self, occurrence, col, show_event_links, url=None):
+        self._occurrence = occurrence
+        self.column = col
+        self.event_class = ''
+        self.show_event_links = show_event_links
+        self.url = url
+        self.title = occurrence.title
+        self._rendered = False
+
+    #---------------------------------------------------------------------------
+    @property
+    def event(self):
+        return self._occurrence.event
 
-        self._str = itertools.chain((link, ), itertools.repeat(r'\\\///'))
+    #---------------------------------------------------------------------------
+    @property
+    def location(self):
+        return self._occurrence.location
+
+    #---------------------------------------------------------------------------
+    @property
+    def start_time(self):
+        return self._occurrence.start_time
+
+    #---------------------------------------------------------------------------
+    @property
+    def end_time(self):
+        return self._occurrence.end_time
+
+    #---------------------------------------------------------------------------
+    def get_absolute_url(self):
+        return self.url
 
     #---------------------------------------------------------------------------
     @html_mark_safe
     def __str__(self):
-        return next(self._str)
+        if self._rendered:
+            return r'\\\///'
+        self._rendered = True
+        if self.url and self.show_event_links:
+            return '<a href="%s">%s</a>' % (self.url, self.title)
+        return self.title
 
 
 #-------------------------------------------------------------------------------
@@ -193,15 +474,15 @@ def create_timeslot_table(
         time_delta=swingtime_settings.TIMESLOT_INTERVAL,
         min_columns=swingtime_settings.TIMESLOT_MIN_COLUMNS,
         css_class_cycles=css_class_cycler,
-        proxy_class=DefaultOccurrenceProxy):
+        proxy_class=DefaultOccurrenceProxy,
+        row_policy=snap_to_grid):
     '''
     Create a grid-like object representing a sequence of times (rows) and
     columns where cells are either empty or reference a wrapper object for
     event occasions that overlap a specific time slot.
 
-    Currently, there is an assumption that if an occurrence has a ``start_time``
-    that falls with the temporal scope of the grid, then that ``start_time`` will
-    also match an interval in the sequence of the computed row entries.
+    The rows spanned by each occurrence are determined by ``row_policy``; by
+    default, the times of the occurrences are snapped to the rows.
 
     * ``dt`` - a ``datetime.datetime`` instance or ``None`` to default to now
     * ``items`` - a queryset or sequence of ``Occurrence`` instances. If
@@ -213,106 +494,170 @@ def create_timeslot_table(
     * ``css_class_cycles`` - if not ``None``, a callable returning a dictionary
       keyed by desired ``EventType`` abbreviations with values that iterate over
       progressive CSS class names for the particular abbreviation.
-    * ``proxy_class`` - a wrapper class for accessing an ``Occurrence`` object.
-      This class should also expose ``event_type`` and ``event_type`` attrs, and
-      handle the custom output via its __str__ method.
+    * ``proxy_class`` - a wrapper class for accessing an ``Occurrence`` object,
+      called with the occurrence, its column, ``show_event_links`` and its URL
+      (or ``None``, if ``show_event_links`` is false). This class should also
+      expose ``event_class`` and ``location`` attrs, and handle the custom
+      output via its __str__ method.
+    * ``row_policy`` - a callable taking the sorted row datetimes, the
+      ``time_delta`` and the start and end times of an item, and returning the
+      (first, last) slice of the rows spanned by the item, or ``None`` to leave
+      the item out (see ``snap_to_grid`` and ``match_grid``).
 
     '''
     from swingtime.models import Occurrence
     dt = dt or datetime_now()
-    dtstart = make_aware(datetime.combine(dt.date(), start_time), dt.tzinfo)
-    assert is_aware(dtstart)
+    assert is_aware(dt)
+    rowkeys = timeslots.get_template(dt.date(), start_time, end_time_delta,
+                                     time_delta, dt.tzinfo).rowkeys
 
-    dtend = dtstart + end_time_delta
-    assert is_aware(dtend)
+    if isinstance(items, QuerySet):
+        items = sorted(items._clone(), key=lambda o: o.start_time)
+    elif not items:
+        day_start = datetime(dt.year, dt.month, dt.day, tzinfo=dt.tzinfo)
+        items = merge_by_start(
+            Occurrence.objects.display_occurrences(
+                location, day_start, day_start + timedelta(days=1)),
+            libvevent.filter_list_by_day(location.scheduled_records, dt))
+    else:
+        items = sorted(items, key=lambda o: o.start_time)
+
+    urls = OccurrenceURLs(location) if show_event_links else None
+    return _layout_timeslots(items, rowkeys, show_event_links, urls,
+                             time_delta, min_columns, css_class_cycles,
+                             proxy_class, row_policy)
+
+
+#-------------------------------------------------------------------------------
+def create_week_timeslot_table(
+        location,
+        show_event_links=True,
+        dt=None,
+        items=None,
+        start_time=swingtime_settings.TIMESLOT_START_TIME,
+        end_time_delta=swingtime_settings.TIMESLOT_END_TIME_DURATION,
+        time_delta=swingtime_settings.TIMESLOT_INTERVAL,
+        min_columns=swingtime_settings.TIMESLOT_MIN_COLUMNS,
+        css_class_cycles=css_class_cycler,
+        proxy_class=DefaultOccurrenceProxy,
+        row_policy=snap_to_grid):
+    '''
+    Create the timeslot grids of the seven days of the week containing ``dt``
+    (starting on ``calendar.firstweekday()``), side by side.
+
+    The occurrences and scheduled events of the whole week are fetched at
+    once, then laid out day by day as by ``create_timeslot_table``, which
+    documents the parameters.
+
+    Returns a list of (time, days) rows, where ``time`` is the row time on the
+    first day of the week, and ``days`` is a list of (datetime, cells) for the
+    row on each day.
 
+    '''
+    from swingtime.models import Occurrence
+    dt = dt or datetime_now()
+    week_start = dt.date() - timedelta(
+        days=(dt.weekday() - calendar.firstweekday()) % 7)
+    dtstarts = [
+        make_aware(
+            datetime.combine(week_start + timedelta(days=i), start_time),
+            dt.tzinfo) for i in range(7)
+    ]
+    dtends = [dtstart + end_time_delta for dtstart in dtstarts]
+
+    # the last row of a day covers the time_delta following its end
+    start, end = dtstarts[0], dtends[-1] + time_delta
     if isinstance(items, QuerySet):
-        items = items._clone()
+        items = sorted(items._clone(), key=lambda o: o.start_time)
     elif not items:
-        items = Occurrence.objects.daily_occurrences(
-            location, dt).select_related('event')
+        items = merge_by_start(
+            Occurrence.objects.display_occurrences(location, start, end),
+            location.scheduled_records.overlapping(start, end))
+    else:
+        items = sorted(items, key=lambda o: o.start_time)
+
+    # distribute the items to the days they overlap
+    day_ends = [dtend + time_delta for dtend in dtends]
+    day_items = [[] for dtstart in dtstarts]
+    for item in items:
+        for i in range(
+                bisect.bisect_right(day_ends, item.start_time),
+                bisect.bisect_left(dtstarts, item.end_time)):
+            day_items[i].append(item)
+
+    urls = OccurrenceURLs(location) if show_event_links else None
+    tables = [
+        _layout_timeslots(
+            day_items[i],
+            timeslots.get_template(dtstarts[i].date(), start_time,
+                                   end_time_delta, time_delta,
+                                   dt.tzinfo).rowkeys, show_event_links, urls,
+            time_delta, min_columns, css_class_cycles, proxy_class,
+            row_policy) for i in range(7)
+    ]
+    return [(days[0][0], list(days)) for days in zip(*tables)]
 
-        vevents = libvevent.filter_list_by_day(location.scheduled_events, dt)
-        occ_vev = [libvevent.OccurenceWrapper(ev) for ev in vevents]
-        all_items = sorted(list(items) + occ_vev, key=lambda o: o.start_time)
 
-    print(len(all_items))
+#-------------------------------------------------------------------------------
+def _layout_timeslots(items, rowkeys, show_event_links, urls, time_delta,
+                      min_columns, css_class_cycles, proxy_class, row_policy):
+    '''
+    Lay out the ``items``, sorted by start time, in the timeslot grid with the
+    given sorted row datetimes (see ``create_timeslot_table``); ``urls`` is an
+    ``OccurrenceURLs`` for the item links, or ``None``.
+
+    '''
+    if not rowkeys:
+        return []
 
-    # build a mapping of timeslot "buckets"
-    timeslots = dict()
-    n = dtstart
-    while n <= dtend:
-        timeslots[n] = {}
-        n += time_delta
+    if css_class_cycles is css_class_cycler:
+        # look the class names up once for the table, not for each column
+        css_class_cycles = functools.partial(css_class_cycler,
+                                             css_class_names())
+    if css_class_cycles:
+        column_classes = defaultdict(css_class_cycles)
+    else:
+        column_classes = None
 
-    # fill the timeslot buckets with occurrence proxies
-    for item in all_items:  #sorted(items):
-        if item.end_time <= dtstart:
+    # Interval partitioning: the items are placed in start order, each in the
+    # lowest column that is free at its first row. ``free`` is a min-heap of
+    # the columns released so far, ``busy`` a min-heap of (release row,
+    # column) for the columns in use.
+    placements = []
+    free = []
+    busy = []
+    column_count = 0
+    for item in items:
+        if item.end_time <= rowkeys[0]:
             # this item began before the start of our schedule constraints
-            # print(item, '!! ends before dtstart')
             continue
 
-        if item.start_time > dtstart:
-            rowkey = current = item.start_time
-        else:
-            rowkey = current = dtstart
-
-        timeslot = timeslots.get(rowkey, None)
-        if timeslot is None:
-            # print(item.title, '!! timeslot is None')
-            # TODO fix atypical interval boundry spans
-            # This is rather draconian, we should probably try to find a better
-            # way to indicate that this item actually occurred between 2 intervals
-            # and to account for the fact that this item may be spanning cells
-            # but on weird intervals
+        rows = row_policy(rowkeys, time_delta, item.start_time, item.end_time)
+        if rows is None:
             continue
+        first, last = rows
 
-        colkey = 0
-        while 1:
-            # keep searching for an open column to place this occurrence
-            if colkey not in timeslot:
-                proxy = proxy_class(item, colkey, show_event_links)
-                timeslot[colkey] = proxy
-
-                while current < item.end_time:
-                    rowkey = current
-                    row = timeslots.get(rowkey, None)
-                    if row is None:
-                        break
-
-                    # we might want to put a sanity check in here to ensure that
-                    # we aren't trampling some other entry, but by virtue of
-                    # sorting all occurrence that shouldn't happen
-                    row[colkey] = proxy
-                    current += time_delta
-                break
-
-            colkey += 1
-
-    # determine the number of timeslot columns we should show
-    column_lens = [len(x) for x in timeslots.values()]
-    column_count = max((min_columns, max(column_lens) if column_lens else 0))
-    column_range = range(column_count)
-    empty_columns = ['' for x in column_range]
+        while busy and busy[0][0] <= first:
+            heapq.heappush(free, heapq.heappop(busy)[1])
+        if free:
+            colkey = heapq.heappop(free)
+        else:
+            colkey = column_count
+            column_count += 1
+        heapq.heappush(busy, (last, colkey))
 
-    if css_class_cycles:
-        column_classes = dict([(i, css_class_cycles()) for i in column_range])
-    else:
-        column_classes = None
+        proxy = proxy_class(item, colkey, show_event_links,
+                            None if urls is None else urls(item))
+        if not proxy.event_class and column_classes is not None:
+            proxy.event_class = column_classes[colkey]["{}".format(
+                proxy.location)]()
+        placements.append((proxy, colkey, first, last))
 
     # create the chronological grid layout
-    table = []
-    for rowkey in sorted(timeslots.keys()):
-        cols = empty_columns[:]
-        for colkey in timeslots[rowkey]:
-            proxy = timeslots[rowkey][colkey]
+    column_count = max(min_columns, column_count)
+    grid = [[''] * column_count for rowkey in rowkeys]
+    for proxy, colkey, first, last in placements:
+        for cols in grid[first:last]:
             cols[colkey] = proxy
-            if not proxy.event_class and column_classes:
-                #proxy.event_class = column_classes[colkey][proxy.event_type.abbr]()
-
-                proxy.event_class = column_classes[colkey]["{}".format(
-                    proxy.location)]()
-
-        table.append((rowkey, cols))
 
-    return table
+    return list(zip(rowkeys, grid))
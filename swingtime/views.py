@@ -2,8 +2,12 @@ from __future__ import print_function, unicode_literals
 
 #######################
 #######################
+import base64
+import binascii
 import calendar
+import hashlib
 import itertools
+import json
 from datetime import date, datetime, time, timedelta
 
 #-------------------------------------------------------------------------------
@@ -12,34 +16,35 @@ from dateutil import parser
 from django import http
 from django.contrib.auth.decorators import login_required
 from django.db import models
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import (Http404, HttpResponse, HttpResponseRedirect,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, render
+from django.template.loader import render_to_string
 from django.urls import reverse
+from django.utils.safestring import mark_safe
+from django.utils.timezone import (get_current_timezone_name, localdate,
+                                   localtime)
 from django.utils.timezone import now as datetime_now
+from django.views.decorators.http import condition
 from django.views.generic.list import ListView
 
 from latex.djangoviews import LaTeX_ListView
-from swingtime import forms, utils
+from swingtime import calendar_data, forms, permissions, utils
 from swingtime.conf import settings as swingtime_settings
-from swingtime.models import BookingLocation, Event, Occurrence
+from swingtime.models import (BookingLocation, Event, Occurrence,
+                              add_virtual_occurrence_stats)
 
-from . import libvevent
+from . import cache, libvevent
 from .forms import LocationSelectForm
 
 if swingtime_settings.CALENDAR_FIRST_WEEKDAY is not None:
     calendar.setfirstweekday(swingtime_settings.CALENDAR_FIRST_WEEKDAY)
 
-#-------------------------------------------------------------------------------
-
-try:
-    import guardian
-except ImportError:
-    use_guardian = False
-else:
-    use_guardian = True
+# the number of occurrences loaded (with their notes) at a time while
+# streaming a webcal feed.
+WEBCAL_CHUNK_SIZE = 500
 
-if use_guardian:
-    from guardian.shortcuts import get_objects_for_user
+#-------------------------------------------------------------------------------
 
 
 def forbidden_response(request, error_message):
@@ -50,31 +55,48 @@ def forbidden_response(request, error_message):
 def get_location_list(user, perm='swingtime.book_can_view'):
     """
     Get a filtered list of locations.
-    Returns a queryset.
+    Returns a queryset, memoized on the user (see ``swingtime.permissions``).
     """
-    if user.has_perm(perm):
-        location_list = BookingLocation.objects.all()
-    elif use_guardian and user.is_authenticated:
-        location_list = get_objects_for_user(user, perm, BookingLocation)
-    else:
-        location_list = BookingLocation.objects.none()
-
-    location_list = location_list.filter(active=True)
-    return location_list
+    return permissions.get_permissions(user).locations(perm)
 
 
 def check_permission(user, perm, obj):
     """
     Check if the user has the permission with the object.
-    This checks both object permission and global.
+    This checks both object permission and global, memoized on the user
+    (see ``swingtime.permissions``).
+    """
+    return permissions.get_permissions(user).has_perm(perm, obj)
+
+
+def fragment_key(location, *parts):
+    """
+    Build the cache key of a rendered calendar fragment for ``location``; it
+    is scoped to the version of the location's bookings and scheduled events,
+    and to the current timezone, in which the times are rendered.
     """
-    return user.has_perm(perm, obj) or user.has_perm(perm)
+    return calendar_data.version_key(location, 'fragment',
+                                     get_current_timezone_name(), *parts)
+
+
+def render_fragment(key, template, get_context):
+    """
+    Render the ``template`` with the context returned by ``get_context()``,
+    without the request, and cache it under ``key``; or, if ``key`` is
+    ``None``, just render it.
+    """
+    compute = lambda: render_to_string(template, get_context())
+    if key is None:
+        return compute()
+    return mark_safe(
+        cache.get_or_compute(key, compute,
+                             swingtime_settings.FRAGMENT_CACHE_TIMEOUT))
 
 
 def get_location_or_404(slug):
     try:
-        return BookingLocation.objects.get_by_slug(slug)
-    except BookingLocation.NotFound:
+        return BookingLocation.objects.resolve_slug(slug)
+    except BookingLocation.DoesNotExist:
         raise Http404
 
 
@@ -96,6 +118,29 @@ calendar_list = login_required(CalendarList_View.as_view())
 #-------------------------------------------------------------------------------
 
 
+def encode_event_cursor(event):
+    """
+    Return the opaque cursor of the event listing page following ``event``.
+    """
+    data = json.dumps([event.title, event.pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def decode_event_cursor(cursor):
+    """
+    Return the (title, pk) of an event listing cursor; raises ValueError if
+    it is malformed.
+    """
+    try:
+        title, pk = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError('Invalid cursor: {!r}'.format(cursor))
+    if not isinstance(pk, int):
+        raise ValueError('Invalid cursor: {!r}'.format(cursor))
+    return '{}'.format(title), pk
+
+
 @login_required
 def event_listing(request,
                   calendar_slug,
@@ -103,14 +148,22 @@ def event_listing(request,
                   events=None,
                   **extra_context):
     '''
-    View all ``events``.
+    View the ``events`` of the location, a page at a time.
 
     If ``events`` is a queryset, clone it. If ``None`` default to all ``Event``s.
+    The events are restricted to the location, and listed by title in pages of
+    ``EVENT_LIST_PAGE_SIZE`` following the event given by the ``after`` cursor
+    request parameter.
 
     Context parameters:
 
     events
-        an iterable of ``Event`` objects
+        an iterable of ``Event`` objects, annotated with their ``url``, their
+        ``occurrence_count`` and the ``next_start`` of their occurrences
+        (stored and virtual)
+
+    next_cursor
+        the ``after`` cursor of the next page, or ``None`` on the last page
 
     ???
         all values passed in via **extra_context
@@ -124,10 +177,35 @@ def event_listing(request,
     elif hasattr(events, '_clone'):
         events = events._clone()
 
+    next_cursor = None
+    if isinstance(events, models.QuerySet):
+        events = events.filter(location=location).order_by('title', 'pk')
+        cursor = request.GET.get('after')
+        if cursor:
+            try:
+                events = events.after(*decode_event_cursor(cursor))
+            except ValueError as e:
+                return http.HttpResponseBadRequest('{}'.format(e))
+        size = swingtime_settings.EVENT_LIST_PAGE_SIZE
+        now = datetime_now()
+        events = list(events.with_occurrence_stats(now)[:size + 1])
+        if len(events) > size:
+            events = events[:size]
+            next_cursor = encode_event_cursor(events[-1])
+        add_virtual_occurrence_stats(events, now)
+
+        urls = utils.OccurrenceURLs(location)
+        for event in events:
+            event.url = urls.for_ids(event.pk) or event.get_absolute_url()
+
     return render(
         request,
         template,
-        dict(extra_context, events=events, location=location),
+        dict(
+            extra_context,
+            events=events,
+            next_cursor=next_cursor,
+            location=location),
     )
 
 
@@ -150,6 +228,10 @@ def event_view(request,
     event
         the event keyed by ``event_pk``
 
+    occurrences
+        the occurrences of the event, stored and virtual, in start order,
+        annotated with their ``url``
+
     event_form
         a form object for updating the event
 
@@ -201,11 +283,20 @@ def event_view(request,
             initial=dict(dtstart=datetime_now()))
     #recurrence_form.fields['location'].queryset = location_list
 
+    occurrences = list(
+        utils.merge_by_start(
+            event.occurrence_set.filter(cancelled=False).order_by(
+                'start_time', 'end_time'), event.virtual_occurrences()))
+    urls = utils.OccurrenceURLs(location)
+    for occurrence in occurrences:
+        occurrence.url = urls(occurrence)
+
     return render(
         request,
         template,
         dict(
             event=event,
+            occurrences=occurrences,
             event_form=event_form,
             recurrence_form=recurrence_form,
             location=location),
@@ -215,16 +306,52 @@ def event_view(request,
 #-------------------------------------------------------------------------------
 
 
+def get_occurrence_or_404(location, event_pk, occurrence_pk=None,
+                          start=None):
+    '''
+    Return the occurrence ``occurrence_pk`` of the event ``event_pk`` at
+    ``location``, or if ``start`` is given, the instance of the event's stored
+    recurrence it identifies (see ``utils.occurrence_stamp``): virtual, or
+    stored if it has been edited. Raises ``Http404`` if there is none or it
+    has been cancelled.
+    '''
+    if start is None:
+        return get_object_or_404(
+            Occurrence,
+            pk=occurrence_pk,
+            event__pk=event_pk,
+            location=location,
+            cancelled=False)
+
+    event = get_object_or_404(Event, pk=event_pk, location=location)
+    try:
+        original_start = utils.parse_occurrence_stamp(start)
+    except ValueError:
+        raise Http404
+    occurrence = event.get_virtual_occurrence(original_start)
+    if occurrence is None:
+        occurrence = get_object_or_404(
+            event.occurrence_set.filter(cancelled=False),
+            original_start_time__gte=original_start,
+            original_start_time__lt=original_start + timedelta(seconds=1))
+    return occurrence
+
+
 @login_required
 def occurrence_view(request,
                     calendar_slug,
                     event_pk,
-                    occurrence_pk,
+                    occurrence_pk=None,
                     template='swingtime/occurrence_detail.html',
-                    form_class=forms.SingleOccurrenceForm):
+                    form_class=forms.SingleOccurrenceForm,
+                    start=None):
     '''
     View a specific occurrence and optionally handle any updates.
 
+    The occurrence is either stored, keyed by ``occurrence_pk``, or an
+    instance of a stored recurrence keyed by its original ``start`` (see
+    ``get_occurrence_or_404``); updating a virtual instance stores it.
+
     Context parameters:
 
     occurrence
@@ -237,11 +364,11 @@ def occurrence_view(request,
     if not check_permission(request.user, 'swingtime.book_can_view', location):
         return forbidden_response(request, 'You cannot view this location')
 
-    occurrence = get_object_or_404(
-        Occurrence,
-        pk=occurrence_pk,
-        event__pk=event_pk,
-        event__location=location)
+    occurrence = get_occurrence_or_404(location, event_pk, occurrence_pk,
+                                       start)
+    if start is not None and occurrence.pk is not None:
+        return http.HttpResponseRedirect(occurrence.get_absolute_url())
+
     if request.method == 'POST':
         if not check_permission(request.user, 'swingtime.book_can_edit',
                                 location):
@@ -250,7 +377,7 @@ def occurrence_view(request,
         form = form_class(request.POST, instance=occurrence)
         if form.is_valid():
             form.save()
-            return http.HttpResponseRedirect(request.path)
+            return http.HttpResponseRedirect(occurrence.get_absolute_url())
     else:
         form = form_class(instance=occurrence)
 
@@ -266,11 +393,13 @@ def occurrence_delete(
         request,
         calendar_slug,
         event_pk,
-        occurrence_pk,
+        occurrence_pk=None,
         template_name='swingtime/occurrence_delete.html',
+        start=None,
 ):
     """
-    Delete an occurrence
+    Delete an occurrence; an instance of a stored recurrence (see
+    ``occurrence_view``) is cancelled instead (see ``Occurrence.cancel``).
     """
     location = get_location_or_404(calendar_slug)
     if not check_permission(request.user, 'swingtime.book_can_delete',
@@ -279,13 +408,14 @@ def occurrence_delete(
                                   'You cannot delete at this location')
 
     event = get_object_or_404(Event, pk=event_pk, location=location)
-    occurrence = get_object_or_404(Occurrence, pk=occurrence_pk, event=event)
+    occurrence = get_occurrence_or_404(location, event.pk, occurrence_pk,
+                                       start)
 
     if request.method == 'POST':
         if '_delete' in request.POST:
             dt = occurrence.start_time
-            occurrence.delete()
-            if event.occurrence_set.count() == 0:
+            occurrence.cancel()
+            if event.occurrence_set.count() == 0 and not event.recurrence:
                 # delete the event as well.
                 event.delete()
                 return http.HttpResponseRedirect(
@@ -410,20 +540,32 @@ def _datetime_view(request,
     if not check_permission(request.user, 'swingtime.book_can_view', location):
         return forbidden_response(request, 'You cannot view this location')
 
-    timeslot_factory = timeslot_factory or utils.create_timeslot_table
-    params = params or {}
+    can_add = check_permission(request.user, 'swingtime.book_can_add',
+                               location)
+
+    def grid_context():
+        return dict(
+            timeslots=(timeslot_factory or utils.create_timeslot_table)(
+                location,
+                True,  # the user can view the location, checked above
+                dt,
+                items,
+                css_class_cycles=None,
+                **(params or {})),
+            location=location,
+            can_add=can_add,
+        )
+
+    key = None
+    if timeslot_factory is None and items is None and not params:
+        key = fragment_key(location, 'day-grid', dt.date().isoformat(),
+                           dt.tzinfo, int(can_add))
     data = dict(
         day=dt,
         next_day=dt + timedelta(days=+1),
         prev_day=dt + timedelta(days=-1),
-        timeslots=timeslot_factory(
-            location,
-            check_permission(request.user, 'swingtime.book_can_view',
-                             location),
-            dt,
-            items,
-            css_class_cycles=None,
-            **params),
+        day_grid=render_fragment(key, 'swingtime/includes/day_grid.html',
+                                 grid_context),
         location=location,
     )
 
@@ -452,6 +594,69 @@ def day_view(request,
 #-------------------------------------------------------------------------------
 
 
+@login_required
+def week_view(request,
+              calendar_slug,
+              year,
+              month,
+              day,
+              template='swingtime/weekly_view.html',
+              items=None,
+              params=None):
+    '''
+    Build the time slot grids of the week containing the given day, from a
+    single query for the week. See utils.create_week_timeslot_table
+    documentation for items and params.
+
+    Context parameters:
+
+    week_start
+        the first day of the week
+
+    days
+        a list of (datetime, column count) for the days of the week
+
+    next_week
+        week_start + 7 days
+
+    prev_week
+        week_start - 7 days
+
+    timeslots
+        time slot grid of (time, [(datetime, cells), ...]) rows
+    '''
+    location = get_location_or_404(calendar_slug)
+    if not check_permission(request.user, 'swingtime.book_can_view', location):
+        return forbidden_response(request, 'You cannot view this location')
+
+    dt = utils.force_aware(date(int(year), int(month), int(day)))
+    params = dict(params or {})
+    params.setdefault('min_columns', 1)
+    timeslots = utils.create_week_timeslot_table(
+        location,
+        True,  # the user can view the location, checked above
+        dt,
+        items,
+        css_class_cycles=None,
+        **params)
+    days = [(day, len(cells)) for day, cells in timeslots[0][1]
+            ] if timeslots else []
+    week_start = days[0][0] if days else dt
+    data = dict(
+        week_start=week_start,
+        days=days,
+        next_week=week_start + timedelta(days=+7),
+        prev_week=week_start + timedelta(days=-7),
+        timeslots=timeslots,
+        location=location,
+    )
+
+    return render(request, template, data)
+
+
+#-------------------------------------------------------------------------------
+
+
 @login_required
 def today_view(request,
                calendar_slug,
@@ -473,7 +678,8 @@ def year_view(request,
               calendar_slug,
               year,
               template='swingtime/yearly_view.html',
-              queryset=None):
+              queryset=None,
+              summary=None):
     '''
 
     Context parameters:
@@ -493,40 +699,56 @@ def year_view(request,
         is a (potentially empty) list of values for that month. Only months
         which have at least 1 occurrence is represented in the list
 
+    summary
+        in summary mode (the ``summary`` argument, by default the ``summary``
+        request parameter), the ``calendar_data.year_summary`` of the
+        location instead of ``by_month``
+
+    can_edit
+        whether the user can edit the occurrences of the location
+
     '''
     location = get_location_or_404(calendar_slug)
     if not check_permission(request.user, 'swingtime.book_can_view', location):
         return forbidden_response(request, 'You cannot view this location')
 
     year = int(year)
+    if summary is None:
+        summary = bool(request.GET.get('summary'))
+    data = dict(
+        year=year,
+        next_year=year + 1,
+        last_year=year - 1,
+        location=location,
+        can_edit=check_permission(request.user, 'swingtime.book_can_edit',
+                                  location))
+
+    if summary:
+        data['summary'] = calendar_data.year_summary(location, year)
+        return render(request, template, data)
+
     if queryset:
         queryset = queryset._clone()
     else:
-        queryset = Occurrence.objects.select_related()
-
-    occurrences = queryset.filter(
-        models.Q(start_time__year=year) | models.Q(end_time__year=year), )
-    occurrences = occurrences.filter(event__location=location)
-
+        queryset = Occurrence.objects.select_related('event',
+                                                     'location__location')
+
+    dtstart = utils.force_aware(datetime(year, 1, 1))
+    dtend = utils.force_aware(datetime(year + 1, 1, 1))
+    occurrences = utils.merge_by_start(
+        queryset.overlapping(location, dtstart,
+                             dtend).order_by('start_time',
+                                             'end_time').iterator(),
+        Occurrence.objects.virtual_occurrences(location, dtstart, dtend))
+
+    # the merged stream is in start order, so the local month of the start
+    # (or January, for those which started the year before) never decreases.
     def grouper_key(o):
-        if o.start_time.year == year:
-            return datetime(year, o.start_time.month, 1)
+        return datetime(year, localtime(max(o.start_time, dtstart)).month, 1)
 
-        return datetime(year, o.end_time.month, 1)
-
-    by_month = [(dt, list(items))
-                for dt, items in itertools.groupby(occurrences, grouper_key)]
-
-    return render(
-        request,
-        template,
-        dict(
-            year=year,
-            by_month=by_month,
-            next_year=year + 1,
-            last_year=year - 1,
-            location=location),
-    )
+    data['by_month'] = [(dt, list(items)) for dt, items in itertools.groupby(
+        occurrences, grouper_key)]
+    return render(request, template, data)
 
 
 #-------------------------------------------------------------------------------
@@ -567,45 +789,28 @@ def month_view(request,
     if not check_permission(request.user, 'swingtime.book_can_view', location):
         return forbidden_response(request, 'You cannot view this location')
 
-    year, month = int(year), int(month)
-
-    cal = calendar.monthcalendar(year, month)
-    dtstart = utils.force_aware(datetime(year, month, 1))
-    last_day = max(cal[-1])
-    dtend = utils.force_aware(datetime(year, month, last_day))
-
-    # TODO Whether to include those occurrences that started in the previous
-    # month but end in this month?
-    if queryset:
+    can_edit = check_permission(request.user, 'swingtime.book_can_edit',
+                                location)
+    if queryset is not None:
         queryset = queryset._clone()
-    else:
-        queryset = Occurrence.objects.select_related()
 
-    occurrences = queryset.filter(
-        start_time__year=year, start_time__month=month)
-    occurrences = occurrences.filter(event__location=location)
-
-    vevents = libvevent.filter_list_by_month(location.scheduled_events,
-                                             dtstart)
-    occ_vev = [libvevent.OccurenceWrapper(ev) for ev in vevents]
-    all_occurrences = sorted(
-        list(occurrences) + occ_vev, key=lambda o: o.start_time)
-
-    # itertools.groupby() makes assumptions about sortedness...
-    by_day = dict([(dom, list(items)) for dom, items in itertools.groupby(
-        all_occurrences, lambda o: o.start_time.day)])
-    # by_day is a mapping of days of the month, to a list of occurence objects
-
-    data = dict(
-        today=datetime_now(),
-        calendar=[[(d, by_day.get(d, [])) for d in row] for row in cal],
-        this_month=dtstart,
-        next_month=dtstart + timedelta(days=+last_day),
-        last_month=dtstart + timedelta(days=-1),
-        base_main_page_has_no_rightbar=
-        True,  # -- supress rightbar in month view.
-        location=location,
-    )
+    def grid_context():
+        context = calendar_data.month_data(location, year, month, queryset)
+        context['can_edit'] = can_edit
+        return context
+
+    data = calendar_data.month_navigation(location, year, month)
+    key = None
+    if queryset is None:
+        # the grid highlights today, when showing the current month
+        today = data['today']
+        is_current = (today.year, today.month) == (data['this_month'].year,
+                                                   data['this_month'].month)
+        key = fragment_key(location, 'month-grid', data['this_month'].year,
+                           data['this_month'].month,
+                           today.day if is_current else 0, int(can_edit))
+    data['month_grid'] = render_fragment(
+        key, 'swingtime/includes/month_grid.html', grid_context)
 
     return render(request, template, data)
 
@@ -625,86 +830,188 @@ def current_month_view(request, calendar_slug):
 @login_required
 def current_year_view(request, calendar_slug):
     dt = datetime_now()
-    return month_view(request, calendar_slug, dt.year)
+    return year_view(request, calendar_slug, dt.year)
 
 
 #-------------------------------------------------------------------------------
 
 
-def calendar_to_response(cal, filename):
+def _calendar_response(response, filename):
     if not filename.endswith('.ics'):
         filename += '.ics'
-    icalstream = cal.serialize()
-    response = HttpResponse(icalstream, content_type='text/calendar')
     response['Filename'] = filename  # IE needs this
     response['Content-Disposition'] = 'attachment; filename=%s' % filename
     return response
 
 
-def webcal(request, room_slug):
-    try:
-        location = BookingLocation.objects.get_by_slug(room_slug)
-    except BookingLocation.DoesNotExist:
-        raise Http404
+def calendar_to_response(cal, filename):
+    icalstream = cal.serialize()
+    return _calendar_response(
+        HttpResponse(icalstream, content_type='text/calendar'), filename)
+
+
+def calendar_stream_to_response(stream, filename):
+    return _calendar_response(
+        StreamingHttpResponse(stream, content_type='text/calendar'),
+        filename)
+
+
+def _chunked(iterable, size):
+    """
+    Yield lists of (up to) ``size`` items from ``iterable``.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
-    occurrences = Occurrence.objects.filter(event__location=location)
-    vevents = [libvevent.from_occurrence(o) for o in occurrences]
-    vevents.extend(location.scheduled_events)
 
+def iter_webcal(location, occurrences, vevents=None):
+    """
+    Serialize the iCalendar feed for ``location`` piece by piece: the
+    calendar header (and any VTIMEZONEs), one VEVENT per occurrence, then
+    the ``vevents`` (by default, the location's scheduled events) and the
+    calendar footer.
+
+    The output is the same as adding every vevent to one
+    ``vobject.iCalendar`` and serializing it (apart from the UIDs, which
+    vobject generates randomly), without holding the whole feed in memory.
+    """
     cal = vobject.iCalendar()
     cal.add('method').value = 'PUBLISH'  # IE/Outlook needs this
     cal.add('x-wr-calname').value = "{}".format(location)
     cal.add('x-published-ttl').value = 'PT15M'
+    if vevents is None:
+        vevents = location.scheduled_events
     for vev in vevents:
         cal.add(vev)
 
-    return calendar_to_response(cal, room_slug)
+    # vobject writes the calendar properties and VTIMEZONEs first, then the
+    # VEVENTs in the order added: the occurrences go in before the
+    # scheduled events.
+    icalstream = cal.serialize()
+    split = icalstream.find('\r\nBEGIN:VEVENT\r\n') + 2
+    if split == 1:
+        split = icalstream.rindex('END:VCALENDAR')
+    yield icalstream[:split]
 
+    for chunk in _chunked(occurrences, WEBCAL_CHUNK_SIZE):
+        models.prefetch_related_objects(
+            [o for o in chunk if o.pk is not None], 'notes', 'event__notes')
+        for o in chunk:
+            yield libvevent.from_occurrence(o).serialize()
 
-#-------------------------------------------------------------------------------
+    yield icalstream[split:]
 
 
-def load_month_data(room_slug, year, month):
-    """
-    This is a copy-paste of swingtime.views.month_view, more or less.
-    """
-    location = BookingLocation.objects.get_by_slug(room_slug)
+def _window_date(value, parse):
+    if value == '':
+        return None  # explicitly unbounded
+    try:
+        return parse(value)
+    except (ValueError, OverflowError):
+        raise ValueError('Bad webcal window value {!r}'.format(value))
 
-    year, month = int(year), int(month)
 
-    cal = calendar.monthcalendar(year, month)
-    dtstart = datetime(year, month, 1)
-    last_day = max(cal[-1])
-    dtend = datetime(year, month, last_day)
+def webcal_window(request):
+    """
+    Return the (start, end) datetimes of the window of occurrences to
+    include in a webcal feed; either may be ``None`` for no bound.
 
-    queryset = Occurrence.objects.select_related()
+    The window is given by the ``start`` and ``end`` (inclusive) date query
+    parameters, or relative to today by ``past_days`` and ``future_days``,
+    and defaults to swingtime_settings.WEBCAL_DEFAULT_WINDOW. An empty value
+    removes that bound. Raises ``ValueError`` for a malformed value.
+    """
+    today = localdate()
+    start = end = None
+    if swingtime_settings.WEBCAL_DEFAULT_WINDOW is not None:
+        past, future = swingtime_settings.WEBCAL_DEFAULT_WINDOW
+        start, end = today - past, today + future
+
+    params = request.GET
+    if 'past_days' in params:
+        start = _window_date(params['past_days'],
+                             lambda v: today - timedelta(days=int(v)))
+    if 'future_days' in params:
+        end = _window_date(params['future_days'],
+                           lambda v: today + timedelta(days=int(v)))
+    if 'start' in params:
+        start = _window_date(params['start'], lambda v: parser.parse(v).date())
+    if 'end' in params:
+        end = _window_date(
+            params['end'],
+            lambda v: parser.parse(v).date() + timedelta(days=1))
+
+    return tuple(
+        None if d is None else utils.force_aware(datetime.combine(d, time(0)))
+        for d in (start, end))
+
+
+def webcal_validators(request, room_slug):
+    """
+    Return the (etag, last_modified) validators for the feed of the given
+    room, without loading any of its occurrences: the ETag is based on the
+    version of the location's bookings, the digest of its scheduled events
+    and the requested window, and the last modification time on the time
+    the location, its bookings and its scheduled events last changed.
+
+    Both are ``None`` if the room or the window is not valid.
+    """
+    validators = getattr(request, '_swingtime_webcal_validators', None)
+    if validators is not None:
+        return validators
 
-    occurrences = queryset.filter(
-        start_time__year=year, start_time__month=month)
-    occurrences = occurrences.filter(event__location=location)
+    validators = (None, None)
+    try:
+        location = BookingLocation.objects.get_by_slug(room_slug)
+        window = webcal_window(request)
+    except (BookingLocation.DoesNotExist, ValueError):
+        pass
+    else:
+        digest, events_modified = location.calendar_events_state()
+        etag = hashlib.md5('|'.join(
+            ['{}'.format(location.pk), '{}'.format(location.version), digest] +
+            ['' if dt is None else dt.isoformat()
+             for dt in window]).encode('utf-8'))
+        validators = (etag.hexdigest(),
+                      max(location.modified, location.bookings_modified,
+                          events_modified))
+
+    request._swingtime_webcal_validators = validators
+    return validators
+
+
+@condition(
+    etag_func=lambda request, room_slug: webcal_validators(
+        request, room_slug)[0],
+    last_modified_func=lambda request, room_slug: webcal_validators(
+        request, room_slug)[1])
+def webcal(request, room_slug):
+    try:
+        location = BookingLocation.objects.get_by_slug(room_slug)
+    except BookingLocation.DoesNotExist:
+        raise Http404
 
-    vevents = libvevent.filter_list_by_month(location.scheduled_events,
-                                             dtstart)
-    occ_vev = [libvevent.OccurenceWrapper(ev) for ev in vevents]
-    all_occurrences = sorted(
-        list(occurrences) + occ_vev, key=lambda o: o.start_time)
+    try:
+        start, end = webcal_window(request)
+    except ValueError as e:
+        return http.HttpResponseBadRequest('{}'.format(e))
 
-    # itertools.groupby() makes assumptions about sortedness...
-    by_day = dict([(dom, list(items)) for dom, items in itertools.groupby(
-        all_occurrences, lambda o: o.start_time.day)])
-    # by_day is a mapping of days of the month, to a list of occurence objects
+    occurrences = Occurrence.objects.overlapping(
+        location, start, end).select_related('event',
+                                             'location__location').iterator()
+    occurrences = itertools.chain(
+        occurrences,
+        Occurrence.objects.virtual_occurrences(location, start, end))
+    vevents = location.scheduled_events
+    if start is not None or end is not None:
+        vevents = vevents.overlapping(start, end)
 
-    data = dict(
-        today=datetime_now(),
-        calendar=[[(d, by_day.get(d, [])) for d in row] for row in cal],
-        this_month=dtstart,
-        next_month=dtstart + timedelta(days=+last_day),
-        last_month=dtstart + timedelta(days=-1),
-        base_main_page_has_no_rightbar=
-        True,  # -- supress rightbar in month view.
-        location=location,
-    )
-    return data
+    return calendar_stream_to_response(
+        iter_webcal(location, occurrences, vevents), room_slug)
 
 
 class PrintMonthSource_View(ListView):
@@ -715,8 +1022,9 @@ class PrintMonthSource_View(ListView):
     template_name = 'swingtime/print/monthly.tex'
 
     def get_context_data(self, **kwargs):
-        return load_month_data(self.kwargs['room'], self.kwargs['year'],
-                               self.kwargs['month'])
+        return calendar_data.load_month_data(self.kwargs['room_slug'],
+                                             self.kwargs['year'],
+                                             self.kwargs['month'])
 
 
 print_month_source = PrintMonthSource_View.as_view()
@@ -730,8 +1038,9 @@ class PrintMonth_View(LaTeX_ListView):
     template_name = 'swingtime/print/monthly.tex'
 
     def get_context_data(self, **kwargs):
-        return load_month_data(self.kwargs['room_slug'], self.kwargs['year'],
-                               self.kwargs['month'])
+        return calendar_data.load_month_data(self.kwargs['room_slug'],
+                                             self.kwargs['year'],
+                                             self.kwargs['month'])
 
 
 print_month = PrintMonth_View.as_view()